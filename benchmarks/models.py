@@ -0,0 +1,56 @@
+from datetime import datetime
+
+import peewee
+
+db = peewee.SqliteDatabase(':memory:')
+
+
+class BaseModel(peewee.Model):
+    class Meta:
+        database = db
+
+
+class User(BaseModel):
+    name = peewee.CharField(index=True)
+    is_active = peewee.BooleanField(default=False)
+    modification_date = peewee.DateTimeField(default=datetime.now)
+
+
+class Category(BaseModel):
+    title = peewee.CharField()
+    slug = peewee.CharField()
+
+
+class Post(BaseModel):
+    title = peewee.CharField()
+    slug = peewee.CharField()
+    category = peewee.ForeignKeyField(Category, backref='posts')
+    author = peewee.ForeignKeyField(User, backref='posts')
+    content = peewee.TextField(default='')
+
+
+MODELS = (User, Category, Post)
+
+
+def seed(rows, chunk_size=500):
+    """
+    Recreate tables with rows users and posts, posts are spread over rows / 10 categories
+    """
+    db.drop_tables(MODELS)
+    db.create_tables(MODELS)
+
+    categories = max(rows // 10, 1)
+
+    with db.atomic():
+        for start in range(0, categories, chunk_size):
+            Category.insert_many([{'title': 'Category {:d}'.format(i), 'slug': 'category-{:d}'.format(i)}
+                                  for i in range(start, min(start + chunk_size, categories))]).execute()
+
+        for start in range(0, rows, chunk_size):
+            end = min(start + chunk_size, rows)
+
+            User.insert_many([{'name': 'user{:d}'.format(i), 'is_active': i % 2 == 0}
+                              for i in range(start, end)]).execute()
+            Post.insert_many([{'title': 'Post {:d}'.format(i), 'slug': 'post-{:d}'.format(i),
+                               'category': i % categories + 1, 'author': i + 1, 'content': 'x' * 200}
+                              for i in range(start, end)]).execute()
@@ -0,0 +1,61 @@
+import wing
+from wing.cache import LocMemCache
+
+from models import User, Category, Post
+
+
+class UserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'users'
+        object_class = User
+        primary_key = 'user'
+        filtering = {
+            'name': ['exact', 'startswith'],
+            'is_active': ['exact'],
+        }
+        max_limit = 10000
+
+
+class BulkUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'bulk-users'
+        object_class = User
+        primary_key = 'user'
+        bulk = True
+
+
+class CategoryResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'categories'
+        object_class = Category
+        primary_key = 'category'
+
+
+class PostResource(wing.ModelResource):
+    category = wing.fields.ForeignKeyField('category', CategoryResource, full=True)
+    author = wing.fields.ForeignKeyField('author', UserResource)
+
+    class Meta:
+        resource_name = 'posts'
+        object_class = Post
+        primary_key = 'post'
+        max_limit = 10000
+
+
+class HTTPCacheUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'cached-users'
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        http_cache = True
+        max_limit = 10000
+
+
+def create_api():
+    api = wing.Api('v1')
+
+    for resource in (UserResource, BulkUserResource, CategoryResource, PostResource, HTTPCacheUserResource):
+        api.register_resource(resource())
+
+    return api
@@ -0,0 +1,219 @@
+"""
+Benchmarks of request pipeline. Requests are handled by falcon application in process, so results show
+the cost of wing and the database only. Results are saved as JSON to compare them between commits:
+
+    python run.py --rows 1000 10000 --page-sizes 20 100 --output results.json
+    python run.py --compare base.json results.json
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from urllib.parse import urlencode
+
+import falcon
+import peewee
+from falcon.testing import create_environ, StartResponseMock
+
+import wing
+from models import seed
+from resources import create_api
+
+
+class Client:
+    def __init__(self, app):
+        self.app = app
+
+    def request(self, method, path, params=None, body='', headers=None):
+        env = create_environ(path=path, method=method, query_string=urlencode(params or []), body=body,
+                             headers=headers)
+        resp = StartResponseMock()
+        data = b''.join(self.app(env, resp))
+
+        return resp.status, resp.headers_dict, data
+
+
+def scenario_list(client, rows, page_size):
+    return 'GET', '/v1/users', {'limit': page_size}, '', None, '200 OK'
+
+
+def scenario_details(client, rows, page_size):
+    return 'GET', '/v1/users/{:d}'.format(rows // 2 or 1), None, '', None, '200 OK'
+
+
+def scenario_filtered_list(client, rows, page_size):
+    return 'GET', '/v1/users', {'limit': page_size, 'name__startswith': 'user1', 'is_active': '1'}, '', None, \
+        '200 OK'
+
+
+def scenario_fk_list(client, rows, page_size):
+    return 'GET', '/v1/posts', {'limit': page_size}, '', None, '200 OK'
+
+
+def scenario_bulk_put(client, rows, page_size):
+    body = json.dumps([{'id': i, 'name': 'user{:d}'.format(i - 1), 'is_active': False}
+                       for i in range(1, min(page_size, rows) + 1)])
+
+    return 'PUT', '/v1/bulk-users', None, body, None, '200 OK'
+
+
+def scenario_not_modified(client, rows, page_size):
+    params = {'limit': page_size}
+    status, headers, data = client.request('GET', '/v1/cached-users', params)
+
+    return 'GET', '/v1/cached-users', params, '', {'If-None-Match': headers['etag']}, '304 Not Modified'
+
+
+SCENARIOS = {
+    'list': scenario_list,
+    'details': scenario_details,
+    'filtered_list': scenario_filtered_list,
+    'fk_list': scenario_fk_list,
+    'bulk_put': scenario_bulk_put,
+    'not_modified': scenario_not_modified,
+}
+
+# scenarios which don't depend on page size are run once per row count
+PAGED_SCENARIOS = ('list', 'filtered_list', 'fk_list', 'bulk_put', 'not_modified')
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(int(round(percent / 100.0 * (len(values) - 1))), len(values) - 1)
+
+    return values[index]
+
+
+def measure(client, request, requests, warmup, alloc_requests):
+    method, path, params, body, headers, expected_status = request
+
+    for i in range(warmup):
+        status, _, data = client.request(method, path, params, body, headers)
+        if status != expected_status:
+            raise RuntimeError('{:s} {:s} returned {:s}: {!r}'.format(method, path, status, data[:200]))
+
+    latencies = []
+    started = time.perf_counter()
+
+    for i in range(requests):
+        start = time.perf_counter()
+        client.request(method, path, params, body, headers)
+        latencies.append(time.perf_counter() - start)
+
+    total = time.perf_counter() - started
+
+    # tracing slows requests down, so memory is measured separately from latency
+    peaks = []
+    for i in range(alloc_requests):
+        tracemalloc.start()
+        client.request(method, path, params, body, headers)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'rps': round(requests / total, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+        'peak_kib': round(max(peaks) / 1024.0, 1) if peaks else None,
+    }
+
+
+def run(args):
+    app = falcon.API()
+    wing.register_api(app, create_api())
+    client = Client(app)
+
+    results = []
+    for rows in args.rows:
+        seed(rows)
+
+        for name in args.scenarios:
+            page_sizes = args.page_sizes if name in PAGED_SCENARIOS else [None]
+
+            for page_size in page_sizes:
+                request = SCENARIOS[name](client, rows, page_size or args.page_sizes[0])
+                result = measure(client, request, args.requests, args.warmup, args.alloc_requests)
+                result.update(scenario=name, rows=rows, page_size=page_size)
+                results.append(result)
+
+                print('{:<14s} rows={:<7d} page_size={:<6s} {:>9.1f} req/s  p50={:.3f}ms  p99={:.3f}ms  '
+                      'peak={}KiB'.format(name, rows, str(page_size or '-'), result['rps'], result['p50_ms'],
+                                          result['p99_ms'], result['peak_kib']))
+
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'date': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+            'python': platform.python_version(),
+            'falcon': falcon.__version__,
+            'peewee': peewee.__version__,
+        },
+        'results': results,
+    }
+
+
+def compare(base, current):
+    """
+    Print change of throughput and p99 latency for every benchmark found in both results
+    """
+    def key(result):
+        return result['scenario'], result['rows'], result['page_size']
+
+    base_results = {key(result): result for result in base['results']}
+
+    print('{:<14s} {:>7s} {:>6s} {:>10s} {:>10s} {:>8s} {:>9s} {:>9s} {:>8s}'.format(
+        'scenario', 'rows', 'page', 'base rps', 'rps', 'change', 'base p99', 'p99', 'change'))
+
+    for result in current['results']:
+        old = base_results.get(key(result))
+        if old is None:
+            continue
+
+        print('{:<14s} {:>7d} {:>6s} {:>10.1f} {:>10.1f} {:>+7.1f}% {:>9.3f} {:>9.3f} {:>+7.1f}%'.format(
+            result['scenario'], result['rows'], str(result['page_size'] or '-'), old['rps'], result['rps'],
+            _change(old['rps'], result['rps']), old['p99_ms'], result['p99_ms'],
+            _change(old['p99_ms'], result['p99_ms'])))
+
+
+def _change(old, new):
+    return (new - old) * 100.0 / old if old else 0.0
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--page-sizes', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--scenarios', nargs='+', choices=sorted(SCENARIOS), default=sorted(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help='measured requests per benchmark')
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--alloc-requests', type=int, default=5, help='requests traced by tracemalloc')
+    parser.add_argument('--output', help='path of JSON results')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'CURRENT'), help='compare two JSON results')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as base, open(args.compare[1]) as current:
+            compare(json.load(base), json.load(current))
+        return
+
+    results = run(args)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
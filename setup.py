@@ -24,6 +24,9 @@ REQUIRED = [
 
 # What packages are optional?
 EXTRAS = {
+    'msgpack': ['msgpack'],
+    'redis': ['redis'],
+    'ijson': ['ijson'],
 }
 
 # The rest you shouldn't have to touch too much :)
@@ -1,8 +1,11 @@
+from contextlib import contextmanager
 from unittest import TestCase
 from urllib.parse import urlencode
 import falcon
 from falcon.testing import create_environ, StartResponseMock
 
+from wing.queries import capture_queries
+
 
 class FuncTestCase(TestCase):
     app = None
@@ -20,21 +23,21 @@ class FuncTestCase(TestCase):
     def tearDown(self):
         pass
 
-    def request(self, method, path, params=None, body=''):
+    def request(self, method, path, params=None, body='', headers=None):
         if not path:
             path = '/'
 
         if not params:
             params = []
 
-        env = create_environ(path=path, method=method.upper(), query_string=urlencode(params), body=body)
+        env = create_environ(path=path, method=method.upper(), query_string=urlencode(params), body=body,
+                             headers=headers)
 
         resp = StartResponseMock()
         result = self.app(env, resp)
 
-        resp.content = ''
-        if result:
-            resp.content = result[0].decode('utf-8')
+        resp.data = b''.join(result)
+        resp.content = resp.data.decode('utf-8', 'replace')
 
         return resp
 
@@ -42,4 +45,15 @@ class FuncTestCase(TestCase):
         self.assertEqual(status, resp.status, 'Response should be %s' % status)
         self.assertIn('content-type', resp.headers_dict, 'Content-Type header should return')
         self.assertTrue(resp.headers_dict['content-type'].startswith('application/json'),
-                        'Default content type should be application/json')
\ No newline at end of file
+                        'Default content type should be application/json')
+
+    @contextmanager
+    def assertNumQueries(self, num):
+        """
+        Check count of SQL statements executed within block
+        """
+        with capture_queries() as queries:
+            yield queries
+
+        self.assertEqual(num, len(queries), 'Expected {:d} queries, executed {:d}:\n{:s}'.format(
+            num, len(queries), '\n'.join(sql for sql, params in queries)))
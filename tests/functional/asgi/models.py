@@ -0,0 +1,12 @@
+import peewee
+
+# worker threads use own connections, so in-memory database can't be used
+db = peewee.SqliteDatabase(None)
+
+
+class Note(peewee.Model):
+    title = peewee.CharField()
+    is_done = peewee.BooleanField(default=False)
+
+    class Meta:
+        database = db
@@ -0,0 +1,32 @@
+import wing
+from wing.cache import LocMemCache
+from .models import Note
+
+
+class NoteResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'notes'
+        object_class = Note
+        primary_key = 'note'
+        filtering = {
+            'title': ['exact'],
+        }
+        export = True
+        cache = LocMemCache()
+        http_cache = True
+
+
+class PositionField(wing.fields.Field):
+    def dehydrate(self, obj):
+        # one query for every object
+        return Note.select().where(Note.id <= obj.id).count()
+
+
+class PositionNoteResource(wing.ModelResource):
+    position = PositionField('id')
+
+    class Meta:
+        resource_name = 'position-notes'
+        object_class = Note
+        primary_key = 'note'
+        export = True
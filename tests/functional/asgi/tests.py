@@ -0,0 +1,161 @@
+import asyncio
+import json
+import os
+import tempfile
+from unittest import TestCase, skipIf
+
+import wing
+from wing.errors import RepeatedQueriesWarning
+
+try:
+    import falcon.asgi
+    from falcon.testing import TestClient
+    from wing.falcon.asgi import register_api, register_metrics, run_in_executor, AsyncQueryCountMiddleware, \
+        BodyReader
+except ImportError:
+    register_api = None
+
+from .models import db, Note
+from .resources import NoteResource, PositionNoteResource
+
+__all__ = ['ASGITests']
+
+
+@skipIf(register_api is None, 'falcon.asgi requires falcon >= 3')
+class ASGITests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.db_file = tempfile.NamedTemporaryFile(suffix='.db', delete=False)
+        cls.db_file.close()
+        db.init(cls.db_file.name)
+
+        api = wing.Api('v1')
+        api.register_resource(NoteResource())
+
+        app = falcon.asgi.App()
+        cls.executor = register_api(app, api)
+        register_metrics(app)
+        cls.client = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.executor.shutdown()
+        db.close()
+        os.unlink(cls.db_file.name)
+
+    def setUp(self):
+        NoteResource._meta.cache.clear()
+
+        db.drop_tables([Note])
+        db.create_tables([Note])
+        Note.create(title='first')
+        Note.create(title='second', is_done=True)
+
+    def test_list(self):
+        resp = self.client.simulate_get('/v1/notes', params={'limit': 1})
+        self.assertEqual('200 OK', resp.status)
+
+        data = json.loads(resp.text)
+        self.assertEqual(['first'], [obj['title'] for obj in data['objects']])
+        self.assertEqual(2, data['meta']['total_count'])
+        self.assertIn('sql;dur=', resp.headers['Server-Timing'])
+
+    def test_metrics(self):
+        self.client.simulate_get('/v1/notes')
+
+        resp = self.client.simulate_get('/_metrics')
+        self.assertEqual('200 OK', resp.status)
+        self.assertIn('resource="notes",action="list",method="GET",stage="dehydrate"', resp.text)
+
+    def test_streamed_metrics(self):
+        resp = self.client.simulate_get('/v1/notes/export')
+        self.assertEqual('200 OK', resp.status)
+        self.assertNotIn('dehydrate;dur=', resp.headers['Server-Timing'])
+
+        resp = self.client.simulate_get('/_metrics')
+        self.assertIn('resource="notes",action="export",method="GET",stage="dehydrate"', resp.text)
+
+    def test_write(self):
+        resp = self.client.simulate_post('/v1/notes', body=json.dumps({'title': 'third'}))
+        self.assertEqual('201 Created', resp.status)
+        self.assertEqual({'note': 3}, json.loads(resp.text))
+
+        resp = self.client.simulate_put('/v1/notes', body=json.dumps([{'id': 1, 'title': 'updated'}]))
+        self.assertEqual('200 OK', resp.status)
+
+        resp = self.client.simulate_get('/v1/notes/1')
+        self.assertEqual('updated', json.loads(resp.text)['title'])
+
+        resp = self.client.simulate_get('/v1/notes/10')
+        self.assertEqual('404 Not Found', resp.status)
+
+        resp = self.client.simulate_post('/v1/notes', body='{')
+        self.assertEqual('400 Bad Request', resp.status)
+
+    def test_body_reader(self):
+        async def receive():
+            for i in range(10):
+                yield 'chunk{:d};'.format(i).encode('utf-8')
+
+        async def read():
+            # queue is smaller than the body, chunks are received while they are read
+            body = BodyReader(asyncio.get_event_loop(), queue_size=2)
+            feeding = asyncio.ensure_future(body.feed(receive()))
+            parts = await run_in_executor(self.executor,
+                                          lambda: [body.read(4), body.read(10), body.read(), body.read()])
+            await feeding
+            return parts
+
+        loop = asyncio.new_event_loop()
+        try:
+            parts = loop.run_until_complete(read())
+        finally:
+            loop.close()
+
+        rest = b''.join('chunk{:d};'.format(i).encode('utf-8') for i in range(2, 10))
+        self.assertEqual([b'chun', b'k0;chunk1;', rest, b''], parts)
+
+    def test_not_modified(self):
+        resp = self.client.simulate_get('/v1/notes')
+        etag = resp.headers['etag']
+
+        resp = self.client.simulate_get('/v1/notes', headers={'If-None-Match': etag})
+        self.assertEqual('304 Not Modified', resp.status)
+
+        self.client.simulate_delete('/v1/notes/2')
+        resp = self.client.simulate_get('/v1/notes', headers={'If-None-Match': etag})
+        self.assertEqual('200 OK', resp.status)
+
+    def test_export(self):
+        Note.insert_many([{'title': 'note {:d}'.format(i)} for i in range(100)]).execute()
+
+        resp = self.client.simulate_get('/v1/notes/export', params={'format': 'ndjson'})
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual(102, len(resp.text.splitlines()))
+
+    def test_repeated_queries(self):
+        api = wing.Api('v1')
+        api.register_resource(NoteResource())
+
+        app = falcon.asgi.App(middleware=[AsyncQueryCountMiddleware(max_repeats=0)])
+        register_api(app, api, self.executor)
+
+        with self.assertWarns(RepeatedQueriesWarning) as cm:
+            resp = TestClient(app).simulate_get('/v1/notes/1')
+            self.assertEqual('200 OK', resp.status)
+
+        self.assertIn('GET /v1/notes/1 executed', str(cm.warning))
+
+    def test_streamed_repeated_queries(self):
+        api = wing.Api('v1')
+        api.register_resource(PositionNoteResource())
+
+        app = falcon.asgi.App(middleware=[AsyncQueryCountMiddleware(max_repeats=1)])
+        register_api(app, api, self.executor)
+
+        with self.assertWarns(RepeatedQueriesWarning) as cm:
+            resp = TestClient(app).simulate_get('/v1/position-notes/export')
+            self.assertEqual('200 OK', resp.status)
+
+        self.assertEqual([1, 2], [obj['position'] for obj in json.loads(resp.text)['objects']])
+        self.assertIn('2x SELECT COUNT', str(cm.warning))
@@ -0,0 +1,260 @@
+import time
+from datetime import datetime
+from unittest import TestCase, mock, skipIf
+
+from wing.cache import LocMemCache, TieredCache, MsgpackCodec
+
+try:
+    import fakeredis
+    from wing.cache import RedisCache
+except ImportError:
+    fakeredis = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+__all__ = ['LocMemCacheTests', 'TieredCacheTests', 'RedisCacheTests']
+
+
+class LocMemCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+        patcher = mock.patch('wing.cache.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.cache = LocMemCache(max_size=3, sweep_interval=10)
+
+    def test_get(self):
+        self.cache.set('key', 'value')
+
+        self.assertEqual('value', self.cache.get('key'))
+        self.assertTrue(self.cache.has('key'))
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertFalse(self.cache.has('unknown'))
+
+    def test_expiration(self):
+        self.cache.set('key', 'value', ttl=5)
+        self.cache.set('forever', 'value')
+
+        self.now += 4
+        self.assertEqual('value', self.cache.get('key'))
+
+        self.now += 1
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has('key'))
+        self.assertEqual('value', self.cache.get('forever'))
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'value', ttl=5))
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertEqual('value', self.cache.get('key'))
+
+        self.now += 5
+        self.assertTrue(self.cache.add('key', 'other'))
+        self.assertEqual('other', self.cache.get('key'))
+
+    def test_lru_eviction(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.set('c', 3)
+        self.cache.get('a')
+        self.cache.set('d', 4)
+
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(1, self.cache.get('a'))
+        self.assertEqual(4, self.cache.get('d'))
+        self.assertEqual(1, self.cache.stats()['evictions'])
+
+    def test_sweep(self):
+        self.cache.set('a', 1, ttl=1)
+        self.cache.set('b', 2, ttl=1)
+
+        self.now += 10
+        self.cache.set('c', 3)
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['size'])
+        self.assertEqual(2, stats['expirations'])
+
+    def test_stats(self):
+        self.cache.set('key', 'value')
+        self.cache.get('key')
+        self.cache.get('unknown')
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats['hits'])
+        self.assertEqual(1, stats['misses'])
+        self.assertEqual(1, stats['size'])
+        self.assertEqual(3, stats['max_size'])
+
+    def test_remove(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        self.cache.remove('a')
+        self.cache.remove('unknown')
+        self.assertIsNone(self.cache.get('a'))
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('b'))
+
+    def test_many(self):
+        self.cache.set_many({'a': 1, 'b': 2}, ttl=5)
+
+        self.assertEqual({'a': 1, 'b': 2}, self.cache.get_many(['a', 'b', 'unknown']))
+
+        self.now += 5
+        self.assertEqual({}, self.cache.get_many(['a', 'b']))
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+
+        patcher = mock.patch('wing.cache.monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.l2 = LocMemCache()
+        self.cache = TieredCache(self.l2, l1_ttl=2)
+        self.other = TieredCache(self.l2, l1_ttl=2)
+
+    def test_get(self):
+        self.cache.set('key', 'value')
+        self.assertEqual('value', self.cache.get('key'))
+        self.assertEqual('value', self.other.get('key'))
+
+        # hot key is served locally
+        self.other.get('key')
+        self.assertEqual(1, self.l2.stats()['hits'])
+
+    def test_bounded_staleness(self):
+        self.cache.set('key', 'value')
+        self.other.get('key')
+        self.cache.set('key', 'changed')
+
+        self.assertEqual('value', self.other.get('key'))
+
+        self.now += 2
+        self.assertEqual('changed', self.other.get('key'))
+
+    def test_ttl(self):
+        self.cache.set('key', 'value', ttl=1)
+        self.now += 1
+
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_many(self):
+        self.cache.set('a', 1)
+        self.l2.set('b', 2)
+
+        self.assertEqual({'a': 1, 'b': 2}, self.cache.get_many(['a', 'b', 'unknown']))
+
+    def test_remove(self):
+        self.cache.set('a', 1)
+        self.assertFalse(self.cache.add('a', 2))
+
+        self.cache.remove('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertTrue(self.cache.add('a', 2))
+        self.assertEqual(2, self.cache.get('a'))
+
+
+@skipIf(fakeredis is None, 'redis and fakeredis are not installed')
+class RedisCacheTests(TestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        self.client = fakeredis.FakeRedis(server=self.server)
+        self.cache = RedisCache(self.client, prefix='test:')
+
+    def test_get(self):
+        self.cache.set('key', {'value': 1})
+        self.cache.set('ttl', 'value', ttl=0.5)
+
+        self.assertEqual({'value': 1}, self.cache.get('key'))
+        self.assertEqual(-1, self.client.ttl('test:key'))
+        self.assertTrue(0 < self.client.pttl('test:ttl') <= 500)
+        self.assertTrue(self.cache.has('key'))
+        self.assertIsNone(self.cache.get('unknown'))
+        self.assertFalse(self.cache.has('unknown'))
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('key', 'value', ttl=5))
+        self.assertFalse(self.cache.add('key', 'other'))
+        self.assertEqual('value', self.cache.get('key'))
+
+    def test_many(self):
+        self.cache.set_many({'a': 1, 'b': 2}, ttl=5)
+
+        self.assertEqual({'a': 1, 'b': 2}, self.cache.get_many(['a', 'b', 'unknown']))
+        self.assertEqual({}, self.cache.get_many([]))
+
+    def test_clear(self):
+        self.client.set('other', 'value')
+        self.client.set('test*other', 'value')
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+
+        self.cache.remove('a')
+        self.assertIsNone(self.cache.get('a'))
+
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(b'value', self.client.get('other'))
+        self.assertEqual(b'value', self.client.get('test*other'))
+
+    def test_clear_without_prefix(self):
+        self.client.set('other', 'value')
+        cache = RedisCache(self.client)
+        cache.set('a', 1)
+
+        self.assertRaises(ValueError, cache.clear)
+        self.assertEqual(b'value', self.client.get('other'))
+        self.assertEqual(1, cache.get('a'))
+
+    def test_connection_pool(self):
+        connection_class = getattr(fakeredis, 'FakeRedisConnection', None) or fakeredis.FakeConnection
+        cache = RedisCache(prefix='pool:', connection_class=connection_class, server=self.server)
+        cache.set('key', 'value')
+
+        self.assertEqual('value', RedisCache(self.client, prefix='pool:').get('key'))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_codec(self):
+        cache = RedisCache(self.client, prefix='test:', codec=MsgpackCodec())
+        version = ['token', datetime(2000, 1, 2, 3, 4, 5, 6)]
+        cache.set('version', version)
+        cache.set('date', datetime(2000, 1, 2))
+
+        self.assertEqual(version, cache.get('version'))
+        self.assertEqual(datetime(2000, 1, 2), cache.get('date'))
+
+    def test_tiered_invalidation(self):
+        first = TieredCache(self.cache, channel='invalidation')
+        second = TieredCache(RedisCache(fakeredis.FakeRedis(server=self.server), prefix='test:'),
+                             channel='invalidation')
+        self.addCleanup(first.close)
+        self.addCleanup(second.close)
+
+        first.set('key', 'value')
+        self.assertEqual('value', second.get('key'))
+
+        first.set('key', 'changed')
+        self.assertTrue(self._wait(lambda: second.get('key') == 'changed'))
+
+        first.clear()
+        self.assertTrue(self._wait(lambda: second.get('key') is None))
+
+    @staticmethod
+    def _wait(condition, timeout=3):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+            time.sleep(0.01)
+
+        return False
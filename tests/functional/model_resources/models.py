@@ -28,7 +28,7 @@ class Category(peewee.Model):
 class Post(peewee.Model):
     title = peewee.CharField()
     slug = peewee.CharField()
-    category = peewee.ForeignKeyField(Category, null=True)
+    category = peewee.ForeignKeyField(Category, null=True, backref='posts')
     content = peewee.TextField(default='')
 
     class Meta:
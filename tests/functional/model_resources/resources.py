@@ -1,4 +1,5 @@
 import wing
+from wing.cache import LocMemCache
 from .models import *
 
 
@@ -12,6 +13,105 @@ class UserResource(wing.ModelResource):
         }
         object_class = User
         primary_key = 'user'
+        export = True
+
+
+class CursorUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'users'
+        object_class = User
+        primary_key = 'user'
+        pagination = 'cursor'
+        limit = 2
+
+
+class CachedUserResource(wing.ModelResource):
+    modification_date = wing.fields.DateTimeField('modification_date', required=False)
+
+    class Meta:
+        resource_name = 'users'
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        response_cache = True
+
+
+class EstimatedCountUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'estimated-users'
+        filtering = {
+            'name': ['exact']
+        }
+        object_class = User
+        primary_key = 'user'
+        count = 'estimated'
+
+
+class CachedCountUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'cached-count-users'
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        count = 'cached'
+        count_cache_ttl = 0.2
+
+
+class HTTPCacheUserResource(wing.ModelResource):
+    modification_date = wing.fields.DateTimeField('modification_date', required=False)
+
+    class Meta:
+        resource_name = 'users'
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        http_cache = True
+
+
+class HTTPCacheCategoryResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'categories'
+        object_class = Category
+        primary_key = 'category'
+        cache = HTTPCacheUserResource._meta.cache
+        http_cache = True
+
+
+class ContentETagUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'content-users'
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        http_cache = True
+        http_cache_etag = 'content'
+
+
+class WeakETagUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'weak-users'
+        filtering = {
+            'name': ['exact']
+        }
+        object_class = User
+        primary_key = 'user'
+        cache = LocMemCache()
+        http_cache = True
+        http_cache_etag = 'weak'
+        modification_field = 'modification_date'
+
+
+class TypedFilterUserResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'typed-users'
+        filtering = {
+            'id': ['exact', 'gt', 'in'],
+            'name': ['contains'],
+            'is_active': ['exact'],
+            'modification_date': ['gte', 'is_null'],
+        }
+        object_class = User
+        primary_key = 'user'
 
 
 class CategoryResource(wing.ModelResource):
@@ -21,10 +121,90 @@ class CategoryResource(wing.ModelResource):
         primary_key = 'category'
 
 
+class BulkCategoryResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'categories'
+        object_class = Category
+        primary_key = 'category'
+        bulk = True
+        bulk_chunk_size = 2
+        stream_body = True
+
+
+class UpsertCategoryResource(wing.ModelResource):
+    class Meta:
+        resource_name = 'upsert-categories'
+        object_class = Category
+        primary_key = 'category'
+        upsert = True
+
+
 class PostResource(wing.ModelResource):
     category = wing.fields.ForeignKeyField('category', CategoryResource)
 
     class Meta:
         resource_name = 'posts'
+        filtering = {
+            'category': ['exact', 'in'],
+        }
+        object_class = Post
+        primary_key = 'post'
+
+
+class ExcerptPostResource(wing.ModelResource):
+    category = wing.fields.ForeignKeyField('category', CategoryResource)
+
+    class Meta:
+        resource_name = 'excerpt-posts'
+        object_class = Post
+        excludes = ['content']
+
+    def dehydrate(self, obj, sender=None):
+        # reads an attribute of excluded field
+        data = super(ExcerptPostResource, self).dehydrate(obj, sender=sender)
+        data['excerpt'] = obj.content[:10]
+        return data
+
+
+class FullPostResource(wing.ModelResource):
+    category = wing.fields.ForeignKeyField('category', CategoryResource, full=True)
+
+    class Meta:
+        resource_name = 'full-posts'
+        object_class = Post
+        primary_key = 'post'
+
+
+class CategoryTitleField(wing.fields.Field):
+    def dehydrate(self, obj):
+        # related object is loaded lazily by every object
+        return obj.category.title if obj.category_id is not None else None
+
+
+class CategoryTitlePostResource(wing.ModelResource):
+    category = CategoryTitleField('category')
+
+    class Meta:
+        resource_name = 'category-title-posts'
+        object_class = Post
+        primary_key = 'post'
+
+
+class StreamedCategoryTitlePostResource(wing.ModelResource):
+    category = CategoryTitleField('category')
+
+    class Meta:
+        resource_name = 'streamed-category-title-posts'
         object_class = Post
         primary_key = 'post'
+        stream = True
+
+
+class CategoryPostsResource(wing.ModelResource):
+    posts = wing.fields.ToManyField('posts', PostResource)
+
+    class Meta:
+        resource_name = 'category-posts'
+        object_class = Category
+        primary_key = 'category'
+        stream = True
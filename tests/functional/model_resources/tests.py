@@ -1,11 +1,36 @@
 import json
+import time
+import warnings
+from datetime import date
+from unittest import skipIf
 
 import wing
-from .models import User, Category, Post
-from .resources import UserResource, CategoryResource, PostResource
+from wing.api import add_middleware
+from wing.errors import ImproperlyConfigured, InvalidValue, RepeatedQueriesWarning, RepeatedQueriesError
+from wing.falcon.middlewares import QueryCountMiddleware
+from wing.instrumentation import MetricsRegistry
+from wing.queries import capture_queries, statement_shape
+from .models import db, User, Category, Post
+from .resources import UserResource, TypedFilterUserResource, EstimatedCountUserResource, CachedCountUserResource, \
+    CursorUserResource, CachedUserResource, HTTPCacheUserResource, HTTPCacheCategoryResource, ContentETagUserResource, \
+    WeakETagUserResource, CategoryResource, BulkCategoryResource, UpsertCategoryResource, PostResource, \
+    FullPostResource, CategoryPostsResource, CategoryTitlePostResource, CategoryTitleField, \
+    ExcerptPostResource, StreamedCategoryTitlePostResource
 from .. import FuncTestCase
 
-__all__ = ['BasicModelTests', 'RelationsModelTests']
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+__all__ = ['BasicModelTests', 'CountTests', 'CursorPaginationTests', 'ResponseCacheTests', 'HTTPCacheTests',
+           'BulkModelTests', 'RelationsModelTests', 'InstrumentationTests', 'QueryCountTests', 'FilterTests',
+           'StatementCacheTests']
 
 
 class BasicModelTests(FuncTestCase):
@@ -37,7 +62,8 @@ class BasicModelTests(FuncTestCase):
         self.assertDictEqual({
             'offset': 0,
             'limit': 20,
-            'total_count': 2
+            'total_count': 2,
+            'count_strategy': 'exact'
         }, data['meta'])
 
         objects = data['objects']
@@ -131,9 +157,71 @@ class BasicModelTests(FuncTestCase):
         self.assertDictEqual({
             'offset': 0,
             'limit': 20,
-            'total_count': 0
+            'total_count': 0,
+            'count_strategy': 'exact'
         }, data['meta'])
 
+    def test_select_fields(self):
+        self.is_safe = True
+
+        resp = self.request('GET', '/v1/users', {'fields': 'name,unknown'})
+        self.check_response(resp, '200 OK')
+
+        objects = json.loads(resp.content)['objects']
+        self.assertEqual([{'name': 'test1'}, {'name': 'test2'}], objects)
+
+        resp = self.request('GET', '/v1/users/2', {'fields': 'id,is_active'})
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual({'id': 2, 'is_active': True}, json.loads(resp.content))
+
+    def test_skip_count(self):
+        self.is_safe = True
+
+        resp = self.request('GET', '/v1/users', {'count': 'false'})
+        self.check_response(resp, '200 OK')
+
+        data = json.loads(resp.content)
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'count_strategy': 'off'}, data['meta'])
+        self.assertEqual(2, len(data['objects']))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_msgpack_format(self):
+        body = msgpack.packb({'name': 'test3', 'is_active': True})
+
+        resp = self.request('POST', '/v1/users', body=body, headers={
+            'Content-Type': 'application/msgpack',
+            'Accept': 'application/msgpack',
+        })
+        self.assertEqual('201 Created', resp.status)
+        self.assertEqual('application/msgpack', resp.headers_dict['content-type'])
+        self.assertEqual({'user': 3}, msgpack.unpackb(resp.data, raw=False))
+
+        resp = self.request('GET', '/v1/users/3', headers={'Accept': 'application/json;q=0.5, application/msgpack'})
+        self.assertEqual('200 OK', resp.status)
+
+        user = msgpack.unpackb(resp.data, raw=False)
+        self.assertEqual('test3', user['name'])
+        self.assertIsInstance(user['modification_date'], str)
+
+        resp = self.request('GET', '/v1/users/3', {'format': 'json'}, headers={'Accept': 'application/msgpack'})
+        self.check_response(resp, '200 OK')
+
+    def test_export(self):
+        resp = self.request('GET', '/v1/users/export', {'format': 'ndjson', 'name__startswith': 'test'})
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual('application/x-ndjson', resp.headers_dict['content-type'])
+        self.assertEqual(['test1', 'test2'], [json.loads(line)['name'] for line in resp.content.splitlines()])
+
+        resp = self.request('GET', '/v1/users/export', {'format': 'csv', 'name': 'test2', 'fields': 'id,name'})
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual('text/csv', resp.headers_dict['content-type'])
+        self.assertEqual(['id,name', '2,test2'], resp.content.splitlines())
+
+        resp = self.request('GET', '/v1/users/export')
+        self.check_response(resp, '200 OK')
+        self.assertEqual(2, len(json.loads(resp.content)['objects']))
+
     def test_wrong_http_method(self):
         resp = self.request('POST', '/v1/users/2')
 
@@ -147,7 +235,7 @@ class BasicModelTests(FuncTestCase):
 
         data = json.loads(resp.content)
 
-        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 1}, data['meta'])
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 1, 'count_strategy': 'exact'}, data['meta'])
 
         objects = data['objects']
         self.assertEqual(1, len(objects))
@@ -159,7 +247,7 @@ class BasicModelTests(FuncTestCase):
         self.assertEqual('200 OK', resp.status, 'Response should be 200 OK')
 
         data = json.loads(resp.content)
-        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 1}, data['meta'])
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 1, 'count_strategy': 'exact'}, data['meta'])
 
         objects = data['objects']
         self.assertEqual(1, len(objects))
@@ -169,7 +257,7 @@ class BasicModelTests(FuncTestCase):
         self.assertEqual('200 OK', resp.status, 'Response should be 200 OK')
 
         data = json.loads(resp.content)
-        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 0}, data['meta'])
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 0, 'count_strategy': 'exact'}, data['meta'])
 
         objects = data['objects']
         self.assertEqual(0, len(objects))
@@ -180,7 +268,7 @@ class BasicModelTests(FuncTestCase):
         self.assertEqual('200 OK', resp.status, 'Response should be 200 OK')
 
         data = json.loads(resp.content)
-        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 2}, data['meta'])
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 2, 'count_strategy': 'exact'}, data['meta'])
 
         objects = data['objects']
         self.assertEqual(2, len(objects))
@@ -242,6 +330,498 @@ class BasicModelTests(FuncTestCase):
         self.assertEqual('test2', data[1]['name'])
 
 
+class CountTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(EstimatedCountUserResource())
+        api.register_resource(CachedCountUserResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        CachedCountUserResource._meta.cache.clear()
+
+        User.drop_table(fail_silently=True)
+        User.create_table()
+        User(name='test1').save()
+        User(name='test2').save()
+
+    def tearDown(self):
+        # statistics are kept by database, not by table
+        db.execute_sql('DROP TABLE IF EXISTS sqlite_stat1')
+
+    def get_meta(self, path, params=None):
+        resp = self.request('GET', path, params)
+        self.check_response(resp, '200 OK')
+
+        meta = json.loads(resp.content)['meta']
+        return meta.get('total_count'), meta['count_strategy']
+
+    def test_estimated_count(self):
+        # without statistics count is exact
+        self.assertEqual((2, 'exact'), self.get_meta('/v1/estimated-users'))
+
+        db.execute_sql('ANALYZE')
+        User(name='test3').save()
+
+        # statistics aren't updated until the next ANALYZE
+        self.assertEqual((2, 'estimated'), self.get_meta('/v1/estimated-users'))
+
+        # statistics don't know count of filtered rows
+        self.assertEqual((1, 'exact'), self.get_meta('/v1/estimated-users', {'name': 'test3'}))
+
+    def test_cached_count(self):
+        self.assertEqual((2, 'cached'), self.get_meta('/v1/cached-count-users'))
+
+        User(name='test3').save()
+        self.assertEqual((2, 'cached'), self.get_meta('/v1/cached-count-users'))
+
+        time.sleep(0.3)
+        self.assertEqual((3, 'cached'), self.get_meta('/v1/cached-count-users'))
+
+
+class CursorPaginationTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(CursorUserResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        User.drop_table(fail_silently=True)
+        User.create_table()
+        for i in range(1, 6):
+            User(name='test%d' % i).save()
+
+    def get_page(self, params=None):
+        resp = self.request('GET', '/v1/users', params)
+        self.check_response(resp, '200 OK')
+
+        return json.loads(resp.content)
+
+    def test_pages(self):
+        data = self.get_page()
+        self.assertEqual(['test1', 'test2'], [o['name'] for o in data['objects']])
+        self.assertEqual(5, data['meta']['total_count'])
+        self.assertIsNone(data['meta']['previous'])
+
+        data = self.get_page({'cursor': data['meta']['next']})
+        self.assertEqual(['test3', 'test4'], [o['name'] for o in data['objects']])
+        self.assertIsNotNone(data['meta']['previous'])
+
+        data = self.get_page({'cursor': data['meta']['next']})
+        self.assertEqual(['test5'], [o['name'] for o in data['objects']])
+        self.assertIsNone(data['meta']['next'])
+
+        data = self.get_page({'cursor': data['meta']['previous']})
+        self.assertEqual(['test3', 'test4'], [o['name'] for o in data['objects']])
+
+        data = self.get_page({'cursor': data['meta']['previous']})
+        self.assertEqual(['test1', 'test2'], [o['name'] for o in data['objects']])
+        self.assertIsNone(data['meta']['previous'])
+        self.assertIsNotNone(data['meta']['next'])
+
+    def test_ordering_option(self):
+        class DescendingResource(wing.ModelResource):
+            class Meta:
+                object_class = User
+                pagination = 'cursor'
+                ordering = ['-id']
+
+        self.assertEqual(['-id'], DescendingResource._meta.ordering)
+
+        with self.assertRaises(ImproperlyConfigured):
+            class NameOrderingResource(wing.ModelResource):
+                class Meta:
+                    object_class = User
+                    pagination = 'cursor'
+                    ordering = ['name', 'id']
+
+    def test_invalid_cursor(self):
+        resp = self.request('GET', '/v1/users', {'cursor': 'invalid'})
+        self.check_response(resp, '400 Bad Request')
+
+        result = json.loads(resp.content)
+        self.assertEqual('Invalid cursor', result.get('title'))
+
+
+class ResponseCacheTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(CachedUserResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        CachedUserResource._meta.cache.clear()
+
+        User.drop_table(fail_silently=True)
+        User.create_table()
+        User(name='test1').save()
+
+    def get_names(self, path='/v1/users'):
+        resp = self.request('GET', path)
+        self.check_response(resp, '200 OK')
+
+        data = json.loads(resp.content)
+        return [o['name'] for o in data['objects']] if 'objects' in data else data['name']
+
+    def test_list_cache(self):
+        self.assertEqual(['test1'], self.get_names())
+
+        # changes made behind resource are not visible until resource is written
+        User(name='test2').save()
+        self.assertEqual(['test1'], self.get_names())
+
+        resp = self.request('POST', '/v1/users', body=json.dumps({'name': 'test3'}))
+        self.check_response(resp, '201 Created')
+
+        self.assertEqual(['test1', 'test2', 'test3'], self.get_names())
+
+    def test_details_cache(self):
+        self.assertEqual('test1', self.get_names('/v1/users/1'))
+
+        User.update(name='changed').execute()
+        self.assertEqual('test1', self.get_names('/v1/users/1'))
+
+        resp = self.request('PUT', '/v1/users/1', body=json.dumps({'name': 'updated'}))
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual('updated', self.get_names('/v1/users/1'))
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_cache_by_format(self):
+        self.assertEqual(['test1'], self.get_names())
+
+        resp = self.request('GET', '/v1/users', headers={'Accept': 'application/msgpack'})
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual('application/msgpack', resp.headers_dict['content-type'])
+        self.assertEqual(['test1'], [obj['name'] for obj in msgpack.unpackb(resp.data, raw=False)['objects']])
+
+    def test_not_found_is_not_cached(self):
+        resp = self.request('GET', '/v1/users/2')
+        self.assertEqual('404 Not Found', resp.status)
+
+        User(name='test2').save()
+
+        resp = self.request('GET', '/v1/users/2')
+        self.check_response(resp, '200 OK')
+
+
+class HTTPCacheTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(HTTPCacheUserResource())
+        api.register_resource(HTTPCacheCategoryResource())
+        api.register_resource(ContentETagUserResource())
+        api.register_resource(WeakETagUserResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        HTTPCacheUserResource._meta.cache.clear()
+
+        User.drop_table(fail_silently=True)
+        Category.drop_table(fail_silently=True)
+        User.create_table()
+        Category.create_table()
+        User(name='test1').save()
+        User(name='test2').save()
+
+    def get_etag(self, path, params=None):
+        resp = self.request('GET', path, params)
+        self.check_response(resp, '200 OK')
+
+        return resp.headers_dict['etag']
+
+    def assertNotModified(self, path, etag, params=None):
+        resp = self.request('GET', path, params, headers={'If-None-Match': etag})
+        self.assertEqual('304 Not Modified', resp.status)
+
+    def assertModified(self, path, etag, params=None):
+        resp = self.request('GET', path, params, headers={'If-None-Match': etag})
+        self.check_response(resp, '200 OK')
+
+    def test_list_etag(self):
+        etag = self.get_etag('/v1/users')
+        self.assertNotModified('/v1/users', etag)
+
+        resp = self.request('PUT', '/v1/users/2', body=json.dumps({'name': 'updated'}))
+        self.check_response(resp, '200 OK')
+
+        self.assertModified('/v1/users', etag)
+
+    def test_object_etag(self):
+        etag = self.get_etag('/v1/users/1')
+        self.assertNotModified('/v1/users/1', etag)
+
+        resp = self.request('PUT', '/v1/users/2', body=json.dumps({'name': 'updated'}))
+        self.check_response(resp, '200 OK')
+        self.assertNotModified('/v1/users/1', etag)
+
+        resp = self.request('PUT', '/v1/users', body=json.dumps([{'id': 2, 'name': 'updated again'}]))
+        self.check_response(resp, '200 OK')
+        self.assertModified('/v1/users/1', etag)
+
+    def test_other_resource_write(self):
+        etag = self.get_etag('/v1/users')
+
+        resp = self.request('POST', '/v1/categories', body=json.dumps({'title': 'Category', 'slug': 'cat'}))
+        self.check_response(resp, '201 Created')
+
+        self.assertNotModified('/v1/users', etag)
+
+    def test_if_modified_since(self):
+        resp = self.request('GET', '/v1/users')
+        last_modified = resp.headers_dict['last-modified']
+
+        resp = self.request('GET', '/v1/users', headers={'If-Modified-Since': last_modified})
+        self.assertEqual('304 Not Modified', resp.status)
+
+    def test_content_etag(self):
+        etag = self.get_etag('/v1/content-users')
+        self.assertNotModified('/v1/content-users', etag)
+
+        # write bypassing API doesn't touch version, but changes content
+        User.update(name='updated').where(User.id == 2).execute()
+        self.assertModified('/v1/content-users', etag)
+
+    def test_weak_etag(self):
+        params = {'name': 'test1'}
+        etag = self.get_etag('/v1/weak-users', params)
+        self.assertTrue(etag.startswith('W/'))
+        self.assertNotModified('/v1/weak-users', etag, params)
+
+        User(name='test3').save()
+        self.assertNotModified('/v1/weak-users', etag, params)
+
+        user = User.get(User.id == 1)
+        user.save()
+        self.assertModified('/v1/weak-users', etag, params)
+
+    def test_weak_etag_with_modified_since(self):
+        resp = self.request('GET', '/v1/weak-users')
+        self.check_response(resp, '200 OK')
+        headers = {'If-None-Match': resp.headers_dict['etag'],
+                   'If-Modified-Since': resp.headers_dict['last-modified']}
+
+        resp = self.request('GET', '/v1/weak-users', headers=headers)
+        self.assertEqual('304 Not Modified', resp.status)
+
+        # deletion doesn't change max modification date, but it changes ETag which takes precedence
+        User.delete().where(User.id == 1).execute()
+        resp = self.request('GET', '/v1/weak-users', headers=headers)
+        self.check_response(resp, '200 OK')
+
+        resp = self.request('GET', '/v1/weak-users', headers={'If-Modified-Since': headers['If-Modified-Since']})
+        self.assertEqual('304 Not Modified', resp.status)
+
+    def test_weak_etag_options(self):
+        with self.assertRaises(ImproperlyConfigured):
+            class NoFieldResource(wing.ModelResource):
+                class Meta:
+                    object_class = User
+                    http_cache = True
+                    http_cache_etag = 'weak'
+
+        with self.assertRaises(ImproperlyConfigured):
+            class UnknownFieldResource(wing.ModelResource):
+                class Meta:
+                    object_class = User
+                    http_cache = True
+                    http_cache_etag = 'weak'
+                    modification_field = 'updated_at'
+
+    @skipIf(msgpack is None, 'msgpack is not installed')
+    def test_etag_by_format(self):
+        resp = self.request('GET', '/v1/users')
+        self.check_response(resp, '200 OK')
+        self.assertEqual('Accept', resp.headers_dict['vary'])
+        etag = resp.headers_dict['etag']
+
+        headers = {'If-None-Match': etag, 'Accept': 'application/msgpack'}
+        resp = self.request('GET', '/v1/users', headers=headers)
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual('application/msgpack', resp.headers_dict['content-type'])
+        self.assertNotEqual(etag, resp.headers_dict['etag'])
+
+        headers['If-None-Match'] = resp.headers_dict['etag']
+        resp = self.request('GET', '/v1/users', headers=headers)
+        self.assertEqual('304 Not Modified', resp.status)
+        self.assertEqual('Accept', resp.headers_dict['vary'])
+
+    def test_format_param(self):
+        resp = self.request('GET', '/v1/users', {'format': 'json'})
+        self.check_response(resp, '200 OK')
+        self.assertNotIn('vary', resp.headers_dict)
+
+        resp = self.request('GET', '/v1/users', {'format': 'unknown'})
+        self.assertEqual('406 Not Acceptable', resp.status)
+
+        resp = self.request('POST', '/v1/categories', {'format': 'unknown'}, body='{}')
+        self.assertEqual('406 Not Acceptable', resp.status)
+
+    def test_weak_etag_details(self):
+        etag = self.get_etag('/v1/weak-users/1')
+        self.assertNotModified('/v1/weak-users/1', etag)
+
+        resp = self.request('GET', '/v1/weak-users/100')
+        self.assertEqual('404 Not Found', resp.status)
+
+
+class BulkModelTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(BulkCategoryResource())
+        api.register_resource(UpsertCategoryResource())
+        api.register_resource(UserResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        Category.drop_table(fail_silently=True)
+        Category.create_table()
+        User.drop_table(fail_silently=True)
+        User.create_table()
+
+    def test_post_list(self):
+        data = [{'title': 'Category {:d}'.format(i), 'slug': 'cat-{:d}'.format(i)} for i in range(5)]
+
+        with self.assertLogs('peewee', level='DEBUG') as logs:
+            resp = self.request('POST', '/v1/categories', body=json.dumps(data))
+        self.check_response(resp, '201 Created')
+
+        self.assertEqual({'objects': [{'category': i} for i in range(1, 6)]}, json.loads(resp.content))
+        self.assertEqual(['Category 0', 'Category 4'],
+                         [c.title for c in Category.select().where(Category.id << [1, 5])])
+
+        inserts = [record for record in logs.output if 'INSERT' in record]
+        self.assertEqual(3, len(inserts))
+
+    def test_put_list_order_without_bulk(self):
+        User(name='test1').save()
+        User(name='test2').save()
+
+        data = [{'id': 2, 'name': 'updated2'}, {'name': 'test3'}, {'id': 1, 'name': 'updated1'}]
+        with capture_queries() as queries:
+            resp = self.request('PUT', '/v1/users', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        # objects are saved one by one in order of data
+        writes = [sql.split()[0] for sql, params in queries if sql.startswith(('INSERT', 'UPDATE'))]
+        self.assertEqual(['UPDATE', 'INSERT', 'UPDATE'], writes)
+        self.assertEqual(['updated1', 'updated2', 'test3'], [user.name for user in User.select().order_by(User.id)])
+
+    def test_post_list_without_bulk(self):
+        resp = self.request('POST', '/v1/users', body=json.dumps([{'name': 'test1'}, {'name': 'test2'}]))
+        self.check_response(resp, '201 Created')
+
+        self.assertEqual({'objects': [{'user': 1}, {'user': 2}]}, json.loads(resp.content))
+        self.assertIsNotNone(User.get(User.id == 2).modification_date)
+
+    def test_post_list_validation(self):
+        data = [{'title': 'Category', 'slug': 'cat'}, {'slug': 'no-title'}]
+
+        resp = self.request('POST', '/v1/categories', body=json.dumps(data))
+        self.check_response(resp, '400 Bad Request')
+
+        self.assertEqual(0, Category.select().count())
+
+    def test_put_list(self):
+        Category(title='Category 1', slug='cat-1').save()
+        Category(title='Category 2', slug='cat-2').save()
+        Category(title='Category 3', slug='cat-3').save()
+
+        data = [
+            {'id': 1, 'title': 'Updated 1', 'slug': 'cat-1'},
+            {'id': 3, 'title': 'Updated 3', 'slug': 'updated-3'},
+            {'title': 'Category 4', 'slug': 'cat-4'},
+        ]
+        resp = self.request('PUT', '/v1/categories', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual([1, 3, 4], [obj['id'] for obj in json.loads(resp.content)['objects']])
+        self.assertEqual(['Updated 1', 'Category 2', 'Updated 3', 'Category 4'],
+                         [c.title for c in Category.select().order_by(Category.id)])
+        self.assertEqual('updated-3', Category.get(Category.id == 3).slug)
+
+    def test_put_list_unknown_object(self):
+        resp = self.request('PUT', '/v1/categories', body=json.dumps([{'id': 10, 'title': 'Unknown', 'slug': 'u'}]))
+        self.check_response(resp, '400 Bad Request')
+
+    def test_upsert(self):
+        Category(title='Category 1', slug='cat-1').save()
+        Category(title='Category 2', slug='cat-2').save()
+
+        data = [
+            {'id': 1, 'title': 'Updated 1', 'slug': 'cat-1'},
+            {'id': 10, 'title': 'Category 10', 'slug': 'cat-10'},
+            {'title': 'Category 11', 'slug': 'cat-11'},
+        ]
+
+        with self.assertLogs('peewee', level='DEBUG') as logs:
+            resp = self.request('PUT', '/v1/upsert-categories', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual([1, 10, 3], [obj['id'] for obj in json.loads(resp.content)['objects']])
+        self.assertEqual([(1, 'Updated 1'), (2, 'Category 2'), (3, 'Category 11'), (10, 'Category 10')],
+                         list(Category.select(Category.id, Category.title).order_by(Category.id).tuples()))
+
+        statements = [record for record in logs.output if 'SELECT' in record or 'INSERT' in record]
+        self.assertEqual(3, len(statements))
+
+    def test_post_ndjson(self):
+        body = ''.join(json.dumps({'title': 'Category {:d}'.format(i), 'slug': 'cat'}) + '\n' for i in range(5))
+
+        resp = self.request('POST', '/v1/categories', body=body, headers={'Content-Type': 'application/x-ndjson'})
+        self.check_response(resp, '201 Created')
+
+        self.assertEqual(5, len(json.loads(resp.content)['objects']))
+        self.assertEqual('Category 4', Category.get(Category.id == 5).title)
+
+    def test_put_ndjson_invalid(self):
+        body = '{"title": "Category 1", "slug": "cat"}\n{"title": "Category 2", "slug": "cat"}\n' \
+               '{"title": "Category 3", "slug": "cat"}\n{"title": "inv'
+
+        resp = self.request('PUT', '/v1/categories', body=body, headers={'Content-Type': 'application/x-ndjson'})
+        self.check_response(resp, '400 Bad Request')
+
+        # the first batch was written before invalid line and is rolled back
+        self.assertEqual(0, Category.select().count())
+
+    @skipIf(ijson is None, 'ijson is not installed')
+    def test_put_json_stream(self):
+        Category(title='Category 1', slug='cat').save()
+
+        data = [{'id': 1, 'title': 'Updated', 'slug': 'cat'}] + \
+               [{'title': 'Category {:d}'.format(i), 'slug': 'cat'} for i in range(2, 6)]
+        resp = self.request('PUT', '/v1/categories', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual([1, 2, 3, 4, 5], [obj['id'] for obj in json.loads(resp.content)['objects']])
+        self.assertEqual('Updated', Category.get(Category.id == 1).title)
+
+    def test_put_json_truncated(self):
+        body = json.dumps([{'title': 'Category {:d}'.format(i), 'slug': 'cat'} for i in range(5)])[:-20]
+
+        for method in ('PUT', 'POST'):
+            resp = self.request(method, '/v1/categories', body=body)
+            self.check_response(resp, '400 Bad Request')
+            self.assertEqual('Invalid format', json.loads(resp.content)['title'])
+
+        self.assertEqual(0, Category.select().count())
+
+    def test_get_ndjson(self):
+        Category(title='Category 1', slug='cat').save()
+        Category(title='Category 2', slug='cat').save()
+
+        resp = self.request('GET', '/v1/categories', params={'format': 'ndjson'})
+        self.assertEqual('200 OK', resp.status)
+        self.assertEqual('application/x-ndjson', resp.headers_dict['content-type'])
+        self.assertEqual(['Category 1', 'Category 2'],
+                         [json.loads(line)['title'] for line in resp.content.splitlines()])
+
+
 class RelationsModelTests(FuncTestCase):
     is_safe = False
 
@@ -252,6 +832,9 @@ class RelationsModelTests(FuncTestCase):
         p_res = PostResource()
         api.register_resource(c_res)
         api.register_resource(p_res)
+        api.register_resource(FullPostResource())
+        api.register_resource(CategoryPostsResource())
+        api.register_resource(ExcerptPostResource())
 
         api.register_nested_resource('categories', p_res, 'category')
 
@@ -293,13 +876,69 @@ class RelationsModelTests(FuncTestCase):
         self.assertEqual('Post #1', post['title'])
         self.assertEqual(None, post['category'])
 
+    def test_compiled_dehydrator(self):
+        self.is_safe = True
+
+        class CustomPostResource(wing.ModelResource):
+            category = wing.fields.ForeignKeyField('category', CategoryResource, full=True)
+            category_title = CategoryTitleField('category', show=['details'])
+            slug_copy = wing.fields.CharField('slug', show=['list'])
+
+            class Meta:
+                object_class = Post
+                resource_name = 'custom-posts'
+
+        post = Post.get(Post.id == 3)
+        category = Category.get(Category.id == 1)
+        cases = [(PostResource(), post), (FullPostResource(), post), (CustomPostResource(), post),
+                 (CategoryTitlePostResource(), post), (CategoryPostsResource(), category)]
+
+        for resource, obj in cases:
+            for sender in (None, 'list', 'details'):
+                expected = {key: field.dehydrate(obj) for key, field in resource.fields.items()
+                            if sender is None or sender in field.show}
+                self.assertEqual(expected, resource.dehydrate(obj, sender=sender))
+
+            names = set(list(resource.fields)[:2])
+            expected = {key: resource.fields[key].dehydrate(obj) for key in names}
+            self.assertEqual(expected, resource.dehydrate(obj, fields=names))
+
+    def test_dotted_attribute(self):
+        self.is_safe = True
+
+        class DottedPostResource(wing.ModelResource):
+            category_title = wing.fields.Field('category.title')
+
+            class Meta:
+                object_class = Post
+                resource_name = 'dotted-posts'
+
+        # attribute name is not a path, as with getattr of Field.dehydrate
+        post = Post.get(Post.id == 3)
+        self.assertRaises(AttributeError, DottedPostResource.fields['category_title'].dehydrate, post)
+        self.assertRaises(AttributeError, DottedPostResource().dehydrate, post)
+
+    def test_overridden_dehydrate(self):
+        Post.update(content='Long content of post').execute()
+
+        resp = self.request('GET', '/v1/excerpt-posts')
+        self.check_response(resp, '200 OK')
+        posts = json.loads(resp.content)['objects']
+        self.assertEqual(6, len(posts))
+        self.assertEqual({'Long conte'}, {post['excerpt'] for post in posts})
+        self.assertNotIn('content', posts[0])
+
+        resp = self.request('GET', '/v1/excerpt-posts/3')
+        self.check_response(resp, '200 OK')
+        self.assertEqual('Long conte', json.loads(resp.content)['excerpt'])
+
     def test_nested_resources(self):
         resp = self.request('GET', '/v1/categories/1/posts')
         self.check_response(resp, '200 OK')
 
         data = json.loads(resp.content)
 
-        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 2}, data['meta'])
+        self.assertDictEqual({'offset': 0, 'limit': 20, 'total_count': 2, 'count_strategy': 'exact'}, data['meta'])
 
         objects = data['objects']
         self.assertEqual(2, len(objects))
@@ -325,3 +964,416 @@ class RelationsModelTests(FuncTestCase):
         data = json.loads(resp.content)
         self.assertEqual(new_post['slug'], data['slug'])
         self.assertEqual(1, data['category'], 'Category should be rewritten by params from URL')
+
+    def test_batch_update_relations(self):
+        data = [{
+            'id': 1,
+            'slug': 'post1',
+            'title': 'Post #1',
+            'category': 2,
+        }, {
+            'slug': 'post-new',
+            'title': 'New',
+            'category': 1,
+        }, {
+            'slug': 'post-new2',
+            'title': 'New #2',
+            'category': 2,
+        }]
+
+        resp = self.request('PUT', '/v1/posts', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        objects = json.loads(resp.content)['objects']
+        self.assertEqual([2, 1, 2], [o['category'] for o in objects])
+
+        resp = self.request('GET', '/v1/categories/2/posts')
+        data = json.loads(resp.content)
+        self.assertEqual(['post1', 'post21', 'post22', 'post-new2'], [o['slug'] for o in data['objects']])
+
+    def test_full_foreign_key(self):
+        self.is_safe = True
+
+        resp = self.request('GET', '/v1/full-posts')
+        self.check_response(resp, '200 OK')
+
+        objects = json.loads(resp.content)['objects']
+        self.assertEqual(6, len(objects))
+        self.assertIsNone(objects[0]['category'])
+        self.assertEqual({'id': 1, 'slug': 'cat1', 'title': 'Category #1'}, objects[2]['category'])
+        self.assertEqual('cat2', objects[5]['category']['slug'])
+
+    def test_to_many_field(self):
+        self.is_safe = True
+
+        resp = self.request('GET', '/v1/category-posts')
+        self.check_response(resp, '200 OK')
+
+        data = json.loads(resp.content)
+        self.assertEqual(2, data['meta']['total_count'])
+
+        objects = data['objects']
+        self.assertEqual([3, 4], objects[0]['posts'])
+        self.assertEqual([5, 6], objects[1]['posts'])
+
+
+class InstrumentationTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(UserResource())
+        wing.register_api(cls.app, api)
+
+        api = wing.Api('v2')
+        api.register_resource(HTTPCacheUserResource())
+        wing.register_api(cls.app, api)
+
+        cls.registry = wing.register_metrics(cls.app)
+
+    def setUp(self):
+        self.registry.clear()
+        HTTPCacheUserResource._meta.cache.clear()
+
+        User.drop_table(fail_silently=True)
+        User.create_table()
+        User(name='test1').save()
+
+    def test_server_timing(self):
+        resp = self.request('GET', '/v1/users')
+        self.check_response(resp, '200 OK')
+
+        stages = [entry.split(';')[0] for entry in resp.headers_dict['server-timing'].split(', ')]
+        for name in ('filters', 'count', 'sql', 'dehydrate', 'serialize', 'total'):
+            self.assertIn(name, stages)
+
+        resp = self.request('POST', '/v1/users', body=json.dumps({'name': 'test2'}))
+        self.check_response(resp, '201 Created')
+        self.assertIn('parse;dur=', resp.headers_dict['server-timing'])
+        self.assertIn('hydrate;dur=', resp.headers_dict['server-timing'])
+        self.assertIn('write;dur=', resp.headers_dict['server-timing'])
+
+    def test_http_cache_timing(self):
+        resp = self.request('GET', '/v2/users')
+        self.check_response(resp, '200 OK')
+
+        resp = self.request('GET', '/v2/users', headers={'If-None-Match': resp.headers_dict['etag']})
+        self.assertEqual('304 Not Modified', resp.status)
+        self.assertIn('http_cache;dur=', resp.headers_dict['server-timing'])
+        self.assertNotIn('sql;dur=', resp.headers_dict['server-timing'])
+
+    def test_metrics(self):
+        self.request('GET', '/v1/users')
+        self.request('GET', '/v1/users')
+
+        resp = self.request('GET', '/_metrics')
+        self.assertEqual('200 OK', resp.status)
+        self.assertTrue(resp.headers_dict['content-type'].startswith('text/plain'))
+        self.assertIn('wing_stage_duration_seconds_bucket{resource="users",action="list",method="GET",stage="total",'
+                      'le="+Inf"} 2', resp.content)
+        self.assertIn('wing_stage_duration_seconds_count{resource="users",action="list",method="GET",stage="sql"} 2',
+                      resp.content)
+
+    def test_streamed_metrics(self):
+        resp = self.request('GET', '/v1/users/export')
+        self.check_response(resp, '200 OK')
+
+        # header is sent before the body is produced
+        self.assertNotIn('dehydrate;dur=', resp.headers_dict['server-timing'])
+
+        resp = self.request('GET', '/_metrics')
+        for stage_name in ('sql', 'dehydrate', 'total'):
+            self.assertIn('wing_stage_duration_seconds_count{{resource="users",action="export",method="GET",'
+                          'stage="{:s}"}} 1'.format(stage_name), resp.content)
+
+    def test_registry_render(self):
+        registry = MetricsRegistry(buckets=(0.1, 1.0))
+        labels = (('resource', 'users'), ('action', 'list'), ('method', 'GET'), ('stage', 'sql'))
+        registry.observe(labels, 0.05)
+        registry.observe(labels, 0.5)
+        registry.observe(labels, 5.0)
+
+        lines = registry.render().splitlines()
+        self.assertIn('wing_stage_duration_seconds_bucket{resource="users",action="list",method="GET",stage="sql",'
+                      'le="0.1"} 1', lines)
+        self.assertIn('wing_stage_duration_seconds_bucket{resource="users",action="list",method="GET",stage="sql",'
+                      'le="1.0"} 2', lines)
+        self.assertIn('wing_stage_duration_seconds_bucket{resource="users",action="list",method="GET",stage="sql",'
+                      'le="+Inf"} 3', lines)
+        self.assertIn('wing_stage_duration_seconds_sum{resource="users",action="list",method="GET",stage="sql"} 5.55',
+                      lines)
+
+
+class QueryCountTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(CategoryResource())
+        api.register_resource(PostResource())
+        api.register_resource(FullPostResource())
+        api.register_resource(CategoryTitlePostResource())
+        api.register_resource(StreamedCategoryTitlePostResource())
+        wing.register_api(cls.app, api)
+
+        cls.middleware = QueryCountMiddleware(max_repeats=2)
+        add_middleware(cls.app, cls.middleware)
+
+    def setUp(self):
+        self.middleware.strict = False
+
+        Category.drop_table(fail_silently=True)
+        Post.drop_table(fail_silently=True)
+        Category.create_table()
+        Post.create_table()
+
+    def create_posts(self, count):
+        for i in range(count):
+            category = Category.create(slug='cat{:d}'.format(i), title='Category #{:d}'.format(i))
+            Post.create(slug='post{:d}'.format(i), title='Post #{:d}'.format(i), category=category)
+
+    def test_num_queries(self):
+        self.create_posts(2)
+
+        with self.assertNumQueries(2):
+            resp = self.request('GET', '/v1/full-posts')
+            self.check_response(resp, '200 OK')
+
+        self.create_posts(5)
+
+        with self.assertNumQueries(2):
+            resp = self.request('GET', '/v1/full-posts')
+            self.check_response(resp, '200 OK')
+
+        self.assertEqual(7, len(json.loads(resp.content)['objects']))
+
+    def test_num_queries_failure(self):
+        self.create_posts(2)
+
+        with self.assertRaises(AssertionError):
+            with self.assertNumQueries(1):
+                self.request('GET', '/v1/posts')
+
+    def test_repeated_queries_warning(self):
+        self.create_posts(2)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            resp = self.request('GET', '/v1/category-title-posts')
+            self.check_response(resp, '200 OK')
+
+        self.create_posts(3)
+
+        with self.assertWarns(RepeatedQueriesWarning) as cm:
+            resp = self.request('GET', '/v1/category-title-posts')
+            self.check_response(resp, '200 OK')
+
+        self.assertIn('5x SELECT', str(cm.warning))
+
+    def test_streamed_repeated_queries(self):
+        self.create_posts(5)
+
+        with self.assertWarns(RepeatedQueriesWarning) as cm:
+            resp = self.request('GET', '/v1/streamed-category-title-posts')
+            self.check_response(resp, '200 OK')
+
+        self.assertEqual(5, len(json.loads(resp.content)['objects']))
+        self.assertIn('5x SELECT', str(cm.warning))
+
+    def test_repeated_queries_strict(self):
+        self.create_posts(5)
+        self.middleware.strict = True
+
+        try:
+            resp = self.request('GET', '/v1/category-title-posts')
+        except RepeatedQueriesError:
+            pass
+        else:
+            # falcon >= 3 handles unexpected errors by default
+            self.assertEqual('500 Internal Server Error', resp.status)
+
+        resp = self.request('GET', '/v1/full-posts')
+        self.check_response(resp, '200 OK')
+
+    def test_capture_nested(self):
+        self.create_posts(1)
+
+        with capture_queries() as outer:
+            with capture_queries() as inner:
+                list(Post.select())
+
+            list(Category.select())
+
+        self.assertEqual(1, len(inner))
+        self.assertEqual(2, len(outer))
+
+    def test_statement_shape(self):
+        self.assertEqual('SELECT * FROM "post" WHERE ("id" IN (?, ...))',
+                         statement_shape('SELECT * FROM "post" WHERE ("id" IN (?, ?, ?))'))
+        self.assertEqual('SELECT * FROM "post" WHERE ("id" IN (%s, ...)) LIMIT %s',
+                         statement_shape('SELECT * FROM "post" WHERE ("id" IN (%s, %s)) LIMIT %s'))
+
+
+class FilterTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(TypedFilterUserResource())
+        api.register_resource(CategoryResource())
+        api.register_resource(PostResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        User.drop_table(fail_silently=True)
+        Category.drop_table(fail_silently=True)
+        Post.drop_table(fail_silently=True)
+        User.create_table()
+        Category.create_table()
+        Post.create_table()
+
+        for i in range(1, 4):
+            User(name='user{:d}'.format(i), is_active=i == 2).save()
+
+    def get_names(self, params, path='/v1/typed-users', attribute='name'):
+        resp = self.request('GET', path, params)
+        self.check_response(resp, '200 OK')
+
+        return [obj[attribute] for obj in json.loads(resp.content)['objects']]
+
+    def test_typed_filters(self):
+        self.assertEqual(['user2', 'user3'], self.get_names({'id__gt': '1'}))
+        self.assertEqual(['user1', 'user3'], self.get_names({'id__in': '1,3'}))
+        self.assertEqual(['user2'], self.get_names({'id': '2'}))
+        self.assertEqual(['user2'], self.get_names({'is_active': 'true'}))
+        self.assertEqual(['user1', 'user3'], self.get_names({'is_active': 'false'}))
+        self.assertEqual(['user1', 'user2', 'user3'], self.get_names({'modification_date__is_null': 'false'}))
+        self.assertEqual([], self.get_names({'modification_date__is_null': '1'}))
+        self.assertEqual(['user1', 'user2', 'user3'], self.get_names({'modification_date__gte': '2000-01-01 00:00:00'}))
+        self.assertEqual(['user3'], self.get_names({'name__contains': '3'}))
+
+    def test_not_allowed_filters(self):
+        self.assertEqual(['user1', 'user2', 'user3'], self.get_names({'id__lt': '2', 'name': 'user1',
+                                                                      'name__contains__exact': '1'}))
+
+    def test_invalid_filter_values(self):
+        for params in ({'id': 'abc'}, {'id__in': '1,x'}, {'is_active': 'maybe'},
+                       {'modification_date__gte': '2000-01-01'}, {'modification_date__is_null': 'unknown'}):
+            resp = self.request('GET', '/v1/typed-users', params)
+            self.check_response(resp, '400 Bad Request')
+            self.assertEqual('Invalid filter', json.loads(resp.content)['title'])
+
+    def test_foreign_key_filter(self):
+        category = Category.create(title='Category', slug='cat')
+        Post.create(title='Post 1', slug='post1', category=category)
+        Post.create(title='Post 2', slug='post2')
+
+        # related object isn't fetched to convert filter value
+        with self.assertNumQueries(2):
+            self.assertEqual(['post1'], self.get_names({'category': '1'}, '/v1/posts', 'slug'))
+
+        self.assertEqual(['post1'], self.get_names({'category__in': '1,5'}, '/v1/posts', 'slug'))
+        self.assertEqual([], self.get_names({'category': '5'}, '/v1/posts', 'slug'))
+
+        resp = self.request('GET', '/v1/posts', {'category': 'x'})
+        self.check_response(resp, '400 Bad Request')
+
+    def test_filter_plan(self):
+        plan = TypedFilterUserResource._filter_plan
+
+        self.assertEqual(('id', 'exact'), plan['id'][:2])
+        self.assertEqual(('id', 'exact'), plan['id__exact'][:2])
+        self.assertEqual(('id', 'gt'), plan['id__gt'][:2])
+        self.assertNotIn('name', plan)
+        self.assertEqual([1, 2], plan['id__in'][2]('1,2'))
+
+    def test_field_convert(self):
+        field = wing.fields.BooleanField('is_active')
+        self.assertIs(False, field.convert('false'))
+        self.assertIs(True, field.convert('1'))
+        self.assertIs(False, field.convert(False))
+        self.assertRaises(InvalidValue, field.convert, 'maybe')
+
+        field = wing.fields.DateField('date')
+        self.assertEqual(date(2020, 1, 2), field.convert('2020-01-02'))
+        self.assertRaises(InvalidValue, field.convert, '2020-13-02')
+
+
+class StatementCacheTests(FuncTestCase):
+    @classmethod
+    def configure(cls):
+        api = wing.Api('v1')
+        api.register_resource(TypedFilterUserResource())
+        api.register_resource(UserResource())
+        api.register_resource(FullPostResource())
+        wing.register_api(cls.app, api)
+
+    def setUp(self):
+        TypedFilterUserResource.db._statements.clear()
+        UserResource.db._statements.clear()
+
+        User.drop_table(fail_silently=True)
+        User.create_table()
+
+        for i in range(1, 6):
+            User(name='user{:d}'.format(i), is_active=i % 2 == 0).save()
+
+    def get_names(self, path, params):
+        with capture_queries() as queries:
+            resp = self.request('GET', path, params)
+            self.check_response(resp, '200 OK')
+
+        return [obj['name'] for obj in json.loads(resp.content)['objects']], queries
+
+    def test_cached_statement(self):
+        names, first = self.get_names('/v1/typed-users', {'id__gt': '1', 'is_active': 'true'})
+        self.assertEqual(['user2', 'user4'], names)
+        self.assertEqual(1, len(TypedFilterUserResource.db._statements))
+
+        names, second = self.get_names('/v1/typed-users', {'id__gt': '2', 'is_active': 'false'})
+        self.assertEqual(['user3', 'user5'], names)
+        self.assertEqual(1, len(TypedFilterUserResource.db._statements))
+
+        # the same statements with new parameters
+        self.assertEqual([sql for sql, params in first], [sql for sql, params in second])
+        self.assertEqual([2, False, 20], list(second.queries[-1][1]))
+
+    def test_shapes(self):
+        self.get_names('/v1/typed-users', {'id__in': '1,2'})
+        names, queries = self.get_names('/v1/typed-users', {'id__in': '3,4,5'})
+        self.assertEqual(['user3', 'user4', 'user5'], names)
+        self.assertEqual(2, len(TypedFilterUserResource.db._statements))
+
+        names, queries = self.get_names('/v1/typed-users', {'id__in': '1,2', 'offset': '1', 'fields': 'id,name'})
+        self.assertEqual(['user2'], names)
+        self.assertEqual(3, len(TypedFilterUserResource.db._statements))
+
+    def test_not_cached_filters(self):
+        names, queries = self.get_names('/v1/users', {'name__startswith': 'user1'})
+        self.assertEqual(['user1'], names)
+        self.assertEqual({}, UserResource.db._statements)
+
+        names, queries = self.get_names('/v1/typed-users', {'modification_date__is_null': 'false', 'limit': '2'})
+        self.assertEqual(['user1', 'user2'], names)
+        self.assertEqual({}, TypedFilterUserResource.db._statements)
+
+    def test_joined_query(self):
+        Category.drop_table(fail_silently=True)
+        Post.drop_table(fail_silently=True)
+        Category.create_table()
+        Post.create_table()
+
+        category = Category.create(title='Category', slug='cat')
+        Post.create(title='Post', slug='post', category=category)
+
+        resp = self.request('GET', '/v1/full-posts')
+        self.check_response(resp, '200 OK')
+        self.assertEqual('Category', json.loads(resp.content)['objects'][0]['category']['title'])
+        self.assertEqual({}, FullPostResource.db._statements)
+
+    def test_disabled(self):
+        TypedFilterUserResource._meta.statement_cache = False
+
+        try:
+            names, queries = self.get_names('/v1/typed-users', {'id': '1'})
+            self.assertEqual(['user1'], names)
+            self.assertEqual({}, TypedFilterUserResource.db._statements)
+        finally:
+            TypedFilterUserResource._meta.statement_cache = True
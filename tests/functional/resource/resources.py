@@ -21,6 +21,19 @@ class UserResource(wing.Resource):
             'pk': len(users)
         }
 
+    def put_list(self, req, **kwargs):
+        data = req.context['data']
+
+        if not isinstance(data, list):
+            raise falcon.HTTPBadRequest(title='Invalid content', description='Data should be a list of objects')
+
+        users[:] = [User() for _ in data]
+
+        for user, item in zip(users, data):
+            self.hydrate(user, item)
+
+        return [self.dehydrate(user, sender='list') for user in users]
+
     def get_details(self, req, **kwargs):
         try:
             user = users[int(kwargs['pk']) - 1]
@@ -1,9 +1,15 @@
 from .. import FuncTestCase
 import json
+from unittest import skipIf
 from .resources import UserResource
 from .models import users, User
 import wing
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 __all__ = ['BasicTests']
 
 
@@ -71,3 +77,13 @@ class BasicTests(FuncTestCase):
 
         self.assertEqual('test2-updated', user['name'])
         self.assertEqual(True, user['is_active'])
+
+    @skipIf(ijson is None, 'ijson is not installed')
+    def test_users_replace(self):
+        # body is parsed to a list even though streaming parser is installed
+        data = [{'name': 'test3', 'is_active': True}]
+        resp = self.request('PUT', '/v1/users', body=json.dumps(data))
+        self.check_response(resp, '200 OK')
+
+        self.assertEqual(['test3'], [user['name'] for user in json.loads(resp.content)])
+        self.assertEqual(['test3'], [user.name for user in users])
@@ -1,6 +1,8 @@
 import unittest
 from functional.resource.tests import *
 from functional.model_resources.tests import *
+from functional.cache.tests import *
+from functional.asgi.tests import *
 
 if __name__ == '__main__':
     unittest.main()
@@ -1,4 +1,4 @@
 from . import fields
-from .api import Api, register_api, register_resource
+from .api import Api, register_api, register_resource, register_metrics
 from .resources import Resource, ModelResource
 
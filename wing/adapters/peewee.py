@@ -1,23 +1,111 @@
+import hashlib
+import json
+import operator
+import sqlite3
+from collections import defaultdict
+from functools import partial
+
 import peewee
 
 from wing.fields import *
 from ..errors import IntegrityError
+from ..instrumentation import timed
+from ..settings import MAX_IN_VALUES, BULK_CHUNK_SIZE, STATEMENT_CACHE_SIZE
 
 
 class Adapter(object):
     def __init__(self, cls):
         self.cls = cls
+        self._filter_factories = {}
+        self._statements = {}
 
     def transaction(self):
         return self.cls._meta.database.transaction()
 
-    def select(self, filters=None):
-        query = self.cls.select()
+    def select(self, filters=None, ordering=None, attributes=None):
+        """
+        Select objects
+        :param attributes: names of attributes to load, all attributes are loaded if it's None
+            or some of attributes are not model fields
+        """
+        if attributes is not None and all(name in self.cls._meta.fields for name in attributes):
+            query = self.cls.select(*[field for name, field in self.cls._meta.fields.items() if name in attributes])
+        else:
+            query = self.cls.select()
+
         if filters:
             query = self.apply_filters(query, filters)
 
+        if ordering:
+            query = self.apply_ordering(query, ordering)
+
         return query
 
+    def iterate(self, query):
+        """
+        Iterate query results without caching rows, Postgres rows are fetched by server-side cursor.
+        Query is executed on the first iteration, so it runs in the thread which consumes results.
+        """
+        if _is_postgres_ext(self.cls._meta.database):
+            from playhouse.postgres_ext import ServerSide
+            yield from ServerSide(query)
+        else:
+            yield from query.iterator()
+
+    @staticmethod
+    @timed('count')
+    def count(query):
+        return query.count()
+
+    @timed('count')
+    def estimate_count(self, query):
+        """
+        Estimate count of rows matching query using planner statistics
+        :return estimated count or None if it cannot be estimated
+        """
+        database = self.cls._meta.database
+
+        if isinstance(database, peewee.PostgresqlDatabase):
+            sql, params = query.sql()
+            plan = database.execute_sql('EXPLAIN (FORMAT JSON) ' + sql, params).fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+
+            return int(plan[0]['Plan']['Plan Rows'])
+
+        if isinstance(database, peewee.SqliteDatabase) and query._where is None:
+            # sqlite_stat1 is filled by ANALYZE and knows only table sizes
+            try:
+                row = database.execute_sql('SELECT stat FROM sqlite_stat1 WHERE tbl = ? LIMIT 1',
+                                           (self.cls._meta.table_name,)).fetchone()
+            except peewee.OperationalError:
+                return None
+
+            return int(row[0].split()[0]) if row else None
+
+        return None
+
+    def get_modification_stats(self, query, attribute):
+        """
+        Max value of modification attribute and count of rows matching query, both with one aggregate query
+        """
+        field = getattr(self.cls, attribute)
+
+        return query.select(peewee.fn.MAX(field).python_value(field.python_value),
+                            peewee.fn.COUNT(self.cls._meta.primary_key)).order_by().scalar(as_tuple=True)
+
+    @staticmethod
+    def query_key(query):
+        """
+        Hash of query SQL and parameters
+        """
+        sql, params = query.sql()
+
+        h = hashlib.md5()
+        h.update((sql + repr(params)).encode('utf-8'))
+        return h.hexdigest()
+
+    @timed('write')
     def delete(self, filters=None):
         """
         Delete objects matching filters parameter
@@ -34,12 +122,109 @@ class Adapter(object):
         return self.cls()
 
     @staticmethod
+    @timed('write')
     def save_object(obj):
         try:
             obj.save()
         except peewee.IntegrityError as e:
             raise IntegrityError(e.args)
 
+    @timed('write')
+    def bulk_create(self, objects, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Insert new objects with multi-row INSERT statements, primary keys are set from RETURNING clause.
+        Objects are saved one by one if database doesn't support RETURNING.
+        """
+        if not self._supports_returning():
+            for obj in objects:
+                self.save_object(obj)
+            return
+
+        pk = self.cls._meta.primary_key
+
+        try:
+            for chunk, rows in self._chunk_rows(objects, chunk_size):
+                cursor = self.cls.insert_many(rows).returning(pk).tuples().execute()
+                for obj, row in zip(chunk, cursor):
+                    setattr(obj, pk.name, row[0])
+                    obj._dirty.clear()
+        except peewee.IntegrityError as e:
+            raise IntegrityError(e.args)
+
+    @timed('write')
+    def upsert(self, objects, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Insert objects with set primary keys or update existing rows by INSERT ... ON CONFLICT DO UPDATE statements
+        """
+        pk = self.cls._meta.primary_key
+        fields = self.cls._meta.fields
+        is_mysql = isinstance(self.cls._meta.database, peewee.MySQLDatabase)
+
+        try:
+            for chunk, rows in self._chunk_rows(objects, chunk_size):
+                preserve = [fields[name] for name in rows[0] if name != pk.name]
+                # MySQL resolves conflicts of any unique index
+                conflict_target = None if is_mysql else [pk]
+
+                self.cls.insert_many(rows).on_conflict(conflict_target=conflict_target, preserve=preserve).execute()
+
+                for obj in chunk:
+                    obj._dirty.clear()
+        except peewee.IntegrityError as e:
+            raise IntegrityError(e.args)
+
+    def supports_upsert(self):
+        database = self.cls._meta.database
+
+        if isinstance(database, peewee.SqliteDatabase):
+            return sqlite3.sqlite_version_info >= (3, 24, 0)
+
+        return isinstance(database, (peewee.PostgresqlDatabase, peewee.MySQLDatabase))
+
+    def _chunk_rows(self, objects, chunk_size):
+        """
+        Split objects to chunks of rows with the same columns, so every chunk is written by one statement
+        :return: iterator of objects chunks and their rows
+        """
+        pk = self.cls._meta.primary_key
+
+        groups = defaultdict(list)
+        for obj in objects:
+            names = tuple(name for name in obj.__data__ if name != pk.name or obj.__data__[name] is not None)
+            groups[names].append(obj)
+
+        for names, group in groups.items():
+            for start in range(0, len(group), chunk_size):
+                chunk = group[start:start + chunk_size]
+                yield chunk, [{name: obj.__data__[name] for name in names} for obj in chunk]
+
+    @timed('write')
+    def bulk_update(self, objects, chunk_size=BULK_CHUNK_SIZE):
+        """
+        Update changed fields of existing objects with one UPDATE statement per chunk
+        """
+        pk = self.cls._meta.primary_key
+        fields = {field for obj in objects for field in obj.dirty_fields if field is not pk}
+
+        if not fields:
+            return
+
+        try:
+            self.cls.bulk_update(objects, fields=list(fields), batch_size=chunk_size)
+        except peewee.IntegrityError as e:
+            raise IntegrityError(e.args)
+
+        for obj in objects:
+            obj._dirty.clear()
+
+    def _supports_returning(self):
+        database = self.cls._meta.database
+
+        if isinstance(database, peewee.SqliteDatabase):
+            return sqlite3.sqlite_version_info >= (3, 35, 0)
+
+        return database.returning_clause
+
     def get_fields(self, excludes=None):
         fields = {}
         if not excludes:
@@ -54,41 +239,234 @@ class Adapter(object):
         return fields
 
     def apply_filters(self, query, filters):
-        conditions = [_filter_get_expr(getattr(self.cls, field), type, val) for field, type, val in filters if
-                      hasattr(self.cls, field)]
+        conditions = []
+        for field, filter_type, value in filters:
+            factory = self.get_filter_factory(field, filter_type)
+            if factory is not None:
+                conditions.append(factory(value))
 
         if conditions:
             return query.where(*conditions)
 
         return query
 
+    def get_filter_factory(self, field, filter_type):
+        """
+        Function which creates filter expression from value, factories are built once per field and filter type
+        :return: function or None if model has no such attribute
+        """
+        key = (field, filter_type)
+
+        try:
+            return self._filter_factories[key]
+        except KeyError:
+            pass
+
+        attribute = getattr(self.cls, field, None)
+        if attribute is None:
+            factory = None
+        else:
+            try:
+                expression = FILTER_EXPRESSIONS[filter_type]
+            except KeyError:
+                raise ValueError('Unknown filter type "{:s}"'.format(filter_type))
+
+            factory = partial(expression, attribute)
+
+        self._filter_factories[key] = factory
+
+        return factory
+
+    def has_attribute(self, attribute):
+        """
+        Check model has field of the name
+        """
+        return attribute in self.cls._meta.fields
+
+    def get_fk_id_attribute(self, attribute, rel_pk):
+        """
+        Name of attribute holding raw value of foreign key
+        :return attribute name or None if foreign key doesn't reference rel_pk field
+        """
+        field = self.cls._meta.fields.get(attribute)
+
+        if isinstance(field, peewee.ForeignKeyField) and field.rel_field.name == rel_pk:
+            return field.object_id_name
+
+        return None
+
+    def join_related(self, query, attributes):
+        """
+        Select objects referenced by foreign keys within the same query
+        :param attributes: foreign key names
+        """
+        for attribute in attributes:
+            field = self.cls._meta.fields.get(attribute)
+            if not isinstance(field, peewee.ForeignKeyField):
+                continue
+
+            rel_model = field.rel_model.alias()
+            query = query.select_extend(rel_model).switch(self.cls).join(
+                rel_model, peewee.JOIN.LEFT_OUTER, on=(field == getattr(rel_model, field.rel_field.name)),
+                attr=attribute)
+
+        return query
+
+    def prefetch_related(self, objects, attributes):
+        """
+        Fetch objects of to-many relations for all objects with one query per MAX_IN_VALUES objects
+        :param objects: list of objects
+        :param attributes: backref names
+        """
+        for attribute in attributes:
+            accessor = getattr(self.cls, attribute, None)
+            if not isinstance(accessor, peewee.BackrefAccessor):
+                continue
+
+            field = accessor.field
+            key_name = field.rel_field.name
+
+            keys = list({getattr(obj, key_name) for obj in objects})
+            rel_objects = defaultdict(list)
+            for i in range(0, len(keys), MAX_IN_VALUES):
+                for rel_obj in field.model.select().where(field.in_(keys[i:i + MAX_IN_VALUES])):
+                    rel_objects[rel_obj.__data__[field.name]].append(rel_obj)
+
+            for obj in objects:
+                related = rel_objects.get(getattr(obj, key_name), [])
+                for rel_obj in related:
+                    setattr(rel_obj, field.name, obj)
+
+                # backref accessor is not a data descriptor, so instance attribute hides it
+                obj.__dict__[attribute] = related
+
+        return objects
+
+    def apply_ordering(self, query, ordering):
+        """
+        Order query by fields, name prefixed with "-" means descending order
+        :param ordering: list of field names
+        """
+        fields = []
+        for name in ordering:
+            field = getattr(self.cls, name.lstrip('-'), None)
+            if field is None:
+                continue
+
+            fields.append(field.desc() if name.startswith('-') else field.asc())
+
+        return query.order_by(*fields)
+
+    def select_page(self, filters, ordering, attributes, limit, offset=0):
+        """
+        Select one page of objects, SQL of queries with the same shape is built once and executed as raw query
+        with new parameters. Shape is stored only if parameters rebuilt from filters match parameters of query
+        built by peewee, queries which can't be rebuilt are always built by peewee.
+        :return: query of objects
+        """
+        statement = self._statement_shape(filters, ordering, attributes, limit, offset)
+
+        if statement is not None:
+            key, params = statement
+
+            sql = self._statements.get(key)
+            if sql:
+                return self.cls.raw(sql, *params)
+
+        query = self.apply_limit(self.select(filters, ordering, attributes), limit, offset)
+
+        if statement is not None and sql is None and len(self._statements) < STATEMENT_CACHE_SIZE:
+            sql, query_params = query.sql()
+
+            # False marks shape which isn't verified again
+            self._statements[key] = sql if list(query_params) == params else False
+
+        return query
+
+    def _statement_shape(self, filters, ordering, attributes, limit, offset):
+        """
+        Key of statement and its parameters, values which change SQL (None, lists) are part of the key
+        :return: tuple of key and parameters or None if statement can't be cached
+        """
+        shape = []
+        params = []
+
+        for field, filter_type, value in filters or ():
+            if filter_type not in STATEMENT_FILTER_TYPES or value is None:
+                return None
+
+            attribute = getattr(self.cls, field, None)
+            if not isinstance(attribute, peewee.Field):
+                return None
+
+            if filter_type == 'in':
+                if not isinstance(value, list) or not value or None in value:
+                    return None
+
+                shape.append((field, filter_type, len(value)))
+                params.extend(attribute.db_value(item) for item in value)
+            else:
+                if isinstance(value, (list, tuple, set, dict, peewee.Node)):
+                    return None
+
+                shape.append((field, filter_type))
+                params.append(attribute.db_value(value))
+
+        params.append(limit)
+        if offset:
+            params.append(offset)
+
+        key = (tuple(shape), tuple(ordering or ()), frozenset(attributes) if attributes is not None else None,
+               bool(offset))
+
+        return key, params
+
+    @staticmethod
+    def apply_limit(query, limit, offset=0):
+        """
+        Limit query to one page, it's done by database unlike slicing of query
+        """
+        query = query.limit(limit)
+        if offset:
+            query = query.offset(offset)
+
+        return query
+
+
+def _is_postgres_ext(database):
+    """
+    Check database supports server-side cursors, the extension module requires psycopg2
+    """
+    try:
+        from playhouse.postgres_ext import PostgresqlExtDatabase
+    except ImportError:
+        return False
+
+    return isinstance(database, PostgresqlExtDatabase)
+
+
+def _filter_in(field, value):
+    if not isinstance(value, list):
+        value = value.split(',')
+
+    return field.in_(value)
+
+
+# filters which are compiled to one placeholder per value, others may change SQL by value
+STATEMENT_FILTER_TYPES = frozenset(('exact', 'gt', 'gte', 'lt', 'lte', 'in'))
 
-def _filter_get_expr(field, filter_type, value):
-    if filter_type == 'exact':
-        return field == value
-    elif filter_type == 'gt':
-        return field > value
-    elif filter_type == 'gte':
-        return field >= value
-    elif filter_type == 'lt':
-        return field < value
-    elif filter_type == 'lte':
-        return field <= value
-    elif filter_type == 'contains':
-        return field.contains(value)
-    elif filter_type == 'startswith':
-        return field.startswith(value)
-    elif filter_type == 'endswith':
-        return field.endswith(value)
-    elif filter_type == 'is_null':
-        return field.is_null(value)
-    elif filter_type == 'in':
-        if not isinstance(value, list):
-            value = value.split(',')
-
-        return field.in_(value)
-    else:
-        raise NotImplemented
+FILTER_EXPRESSIONS = {
+    'exact': operator.eq,
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+    'contains': lambda field, value: field.contains(value),
+    'startswith': lambda field, value: field.startswith(value),
+    'endswith': lambda field, value: field.endswith(value),
+    'is_null': lambda field, value: field.is_null(value),
+    'in': _filter_in,
+}
 
 
 def create_resource_field(orm_field):
@@ -1,9 +1,10 @@
 from collections import defaultdict
 
-from falcon.api_helpers import prepare_middleware
-
-from wing.falcon.middlewares import HTTPCache
-from .falcon.resources import ItemFalconResource, CollectionFalconResource, create_func_resource
+from wing.falcon.middlewares import HTTPCache, InstrumentationMiddleware
+from .compat import prepare_middleware
+from .instrumentation import MetricsRegistry
+from .falcon.resources import ItemFalconResource, CollectionFalconResource, ExportFalconResource, \
+    MetricsResource, create_func_resource
 
 
 class Api:
@@ -23,34 +24,83 @@ class Api:
 
 
 def register_api(app, api):
+    for prefix, resource in iter_resources(api):
+        register_resource(app, prefix, resource)
+
+
+def register_resource(app, prefix, resource):
+    for uri, falcon_resource in get_routes(prefix, resource):
+        app.add_route(uri, falcon_resource)
+
+    if resource._meta.http_cache and resource._meta.cache:
+        add_middleware(app, HTTPCache(resource._meta.cache, resource))
+
+
+def iter_resources(api):
+    """
+    Resources of API with URI prefixes, nested resources are prefixed by URI of parent object
+    """
     prefix = '/' + api.name
     for res in api.resources.values():
-        register_resource(app, prefix, res)
+        yield prefix, res
 
     for res_name, nested_resources in api.nested.items():
         for nested_resource, foreign_key in nested_resources:
-            register_resource(
-                app,
-                '{:s}/{:s}/{{{:s}}}'.format(prefix, api.resources[res_name]._meta.resource_name, foreign_key),
+            yield '{:s}/{:s}/{{{:s}}}'.format(prefix, api.resources[res_name]._meta.resource_name, foreign_key), \
                 nested_resource
-            )
 
 
-def register_resource(app, prefix, resource):
-    item_res = ItemFalconResource(resource)
-    coll_res = CollectionFalconResource(resource)
-
+def get_routes(prefix, resource):
+    """
+    Falcon resources of wing resource
+    :return: list of tuples of URI and falcon resource
+    """
     prefix = "{:s}/{:s}".format(prefix, resource._meta.resource_name)
 
-    app.add_route(prefix, coll_res)
-    app.add_route('{:s}/{{{:s}}}'.format(prefix, resource._meta.primary_key), item_res)
+    routes = [
+        (prefix, CollectionFalconResource(resource)),
+        ('{:s}/{{{:s}}}'.format(prefix, resource._meta.primary_key), ItemFalconResource(resource)),
+    ]
+
+    if resource._meta.export:
+        routes.append((prefix + '/export', ExportFalconResource(resource)))
 
     for func_name, uri, http_methods in resource.custom_methods:
         func = getattr(resource, func_name)
+        routes.append((prefix + uri, create_func_resource(func, http_methods)))
 
-        custom_res = create_func_resource(func, http_methods)
-        app.add_route(prefix + uri, custom_res)
+    return routes
 
-    if resource._meta.http_cache and resource._meta.cache:
-        middleware = HTTPCache(resource._meta.cache, resource)
-        app._middleware.extend(prepare_middleware([middleware]))
+
+def register_metrics(app, registry=None, uri='/_metrics'):
+    """
+    Time stages of requests and expose their histograms in Prometheus text format
+    :param registry: MetricsRegistry, a new one is created by default
+    :param uri: URI of metrics, metrics route isn't added if it's None
+    :return: registry
+    """
+    if registry is None:
+        registry = MetricsRegistry()
+
+    add_middleware(app, InstrumentationMiddleware(registry))
+
+    if uri is not None:
+        app.add_route(uri, MetricsResource(registry))
+
+    return registry
+
+
+def add_middleware(app, middleware):
+    """
+    Append middleware to already created falcon application
+    """
+    if hasattr(app, 'add_middleware'):
+        app.add_middleware(middleware)
+        return
+
+    request_mw, resource_mw, response_mw = app._middleware
+    new_request_mw, new_resource_mw, new_response_mw = prepare_middleware(
+        [middleware], independent_middleware=app._independent_middleware)
+
+    # independent response middleware runs in reverse order
+    app._middleware = (request_mw + new_request_mw, resource_mw + new_resource_mw, new_response_mw + response_mw)
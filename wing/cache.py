@@ -1,5 +1,14 @@
 import pickle
+from collections import OrderedDict
 from datetime import datetime
+from threading import RLock
+from time import monotonic
+from uuid import uuid4
+
+from .settings import DEFAULT_CACHE_MAX_SIZE, DEFAULT_CACHE_SWEEP_INTERVAL, DEFAULT_L1_CACHE_TTL
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+DATETIME_FORMAT_NO_MS = '%Y-%m-%dT%H:%M:%S'
 
 
 class DummyCache:
@@ -15,6 +24,12 @@ class DummyCache:
     def has(self, key):
         return False
 
+    def get_many(self, keys):
+        return {}
+
+    def set_many(self, mapping, ttl=None):
+        pass
+
     def remove(self, key):
         pass
 
@@ -23,78 +38,367 @@ class DummyCache:
 
 
 class LocMemCache:
-    def __init__(self):
-        self.data = {}
+    """
+    Thread-safe in-process cache with LRU eviction and expiration of values.
+    Expired values are removed on access and by periodic sweep on writes.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_MAX_SIZE, sweep_interval=DEFAULT_CACHE_SWEEP_INTERVAL):
+        """
+        :param max_size: max count of values, least recently used values are evicted
+        :param sweep_interval: interval in seconds between removals of all expired values
+        """
+        self.max_size = max_size
+        self.sweep_interval = sweep_interval
+        self.data = OrderedDict()
+        self.lock = RLock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._next_sweep = monotonic() + sweep_interval
 
     def add(self, key, val, ttl=None):
-        if self.has(key):
-            return False
+        with self.lock:
+            if self.has(key):
+                return False
 
-        self.set(key, val, ttl)
+            self.set(key, val, ttl)
 
         return True
 
     def set(self, key, val, ttl=None):
-        expire_ts = datetime.now().timestamp() + ttl if ttl is not None else None
-        self.data[key] = (val, expire_ts)
+        now = monotonic()
+        expire = now + ttl if ttl is not None else None
+
+        with self.lock:
+            self._sweep(now)
+
+            self.data[key] = (val, expire)
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+                self.evictions += 1
 
     def get(self, key):
-        val, expire = self.data.get(key, (None, None))
+        with self.lock:
+            if not self._alive(key):
+                self.misses += 1
+                return None
 
-        if expire is not None and expire > datetime.now().timestamp():
-            del self.data[key]
-            return None
+            self.hits += 1
+            self.data.move_to_end(key)
 
-        return val
+            return self.data[key][0]
 
     def has(self, key):
-        val, expire = self.data.get(key, (None, None))
+        with self.lock:
+            return self._alive(key)
+
+    def get_many(self, keys):
+        """
+        :return: dictionary of found values by keys
+        """
+        with self.lock:
+            return {key: self.get(key) for key in keys if self._alive(key)}
 
-        return expire and expire < datetime.now().timestamp()
+    def set_many(self, mapping, ttl=None):
+        with self.lock:
+            for key, val in mapping.items():
+                self.set(key, val, ttl)
 
     def remove(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        """
+        Counters to size the cache under load
+        """
+        with self.lock:
+            return {
+                'size': len(self.data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+    def _alive(self, key):
+        """
+        Check value exists and is not expired, expired value is removed
+        """
         try:
-            del self.data[key]
+            val, expire = self.data[key]
         except KeyError:
-            pass
+            return False
+
+        if expire is not None and expire <= monotonic():
+            del self.data[key]
+            self.expirations += 1
+            return False
+
+        return True
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+
+        expired = [key for key, (val, expire) in self.data.items() if expire is not None and expire <= now]
+        for key in expired:
+            del self.data[key]
+
+        self.expirations += len(expired)
+        self._next_sweep = now + self.sweep_interval
+
+
+class TieredCache:
+    """
+    Local LRU cache in front of shared cache. Values are kept locally for short time, so workers converge
+    on changes done by other workers within l1_ttl seconds. If shared cache is RedisCache and invalidation
+    channel is set, changed keys are published and removed from local caches of other workers immediately.
+    """
+
+    def __init__(self, l2, l1=None, l1_ttl=DEFAULT_L1_CACHE_TTL, channel=None):
+        """
+        :param l2: shared cache
+        :param l1: local cache, LocMemCache by default
+        :param l1_ttl: max time in seconds value is kept in local cache
+        :param channel: name of Redis pub/sub channel of invalidation messages
+        """
+        self.l1 = l1 if l1 is not None else LocMemCache()
+        self.l2 = l2
+        self.l1_ttl = l1_ttl
+        self.channel = channel
+        self.worker_id = uuid4().hex
+        self._listener = None
+
+        if channel is not None:
+            self._listen()
+
+    def add(self, key, val, ttl=None):
+        if not self.l2.add(key, val, ttl):
+            return False
+
+        self.l1.set(key, val, self._l1_ttl(ttl))
+        self._publish(key)
+        return True
+
+    def set(self, key, val, ttl=None):
+        self.l2.set(key, val, ttl)
+        self.l1.set(key, val, self._l1_ttl(ttl))
+        self._publish(key)
+
+    def get(self, key):
+        val = self.l1.get(key)
+        if val is not None:
+            return val
+
+        val = self.l2.get(key)
+        if val is not None:
+            self.l1.set(key, val, self.l1_ttl)
+
+        return val
+
+    def has(self, key):
+        return self.l1.has(key) or self.l2.has(key)
+
+    def get_many(self, keys):
+        keys = list(keys)
+        values = self.l1.get_many(keys)
+
+        missing = [key for key in keys if key not in values]
+        if missing:
+            found = self.l2.get_many(missing)
+            self.l1.set_many(found, self.l1_ttl)
+            values.update(found)
+
+        return values
+
+    def set_many(self, mapping, ttl=None):
+        self.l2.set_many(mapping, ttl)
+        self.l1.set_many(mapping, self._l1_ttl(ttl))
+
+        for key in mapping:
+            self._publish(key)
+
+    def remove(self, key):
+        self.l2.remove(key)
+        self.l1.remove(key)
+        self._publish(key)
 
     def clear(self):
-        self.data = {}
+        self.l2.clear()
+        self.l1.clear()
+        self._publish(None)
+
+    def close(self):
+        """
+        Stop listening of invalidation messages
+        """
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
+
+    def _l1_ttl(self, ttl):
+        return self.l1_ttl if ttl is None else min(ttl, self.l1_ttl)
+
+    def _publish(self, key):
+        if self.channel is None:
+            return
+
+        self.l2.client.publish(self.channel, '{:s}:{:s}'.format(self.worker_id, key if key is not None else ''))
+
+    def _listen(self):
+        pubsub = self.l2.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: self._on_message})
+        self._listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def _on_message(self, message):
+        data = message['data']
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+
+        worker_id, _, key = data.partition(':')
+        if worker_id == self.worker_id:
+            return
+
+        if key:
+            self.l1.remove(key)
+        else:
+            self.l1.clear()
+
+
+class MsgpackCodec:
+    """
+    Compact and fast codec of cached values, datetime values are kept as msgpack extension type
+    """
+    DATETIME_EXT = 1
+
+    def __init__(self):
+        import msgpack
+        self.msgpack = msgpack
+
+    def dumps(self, val):
+        return self.msgpack.packb(val, use_bin_type=True, default=self._default)
+
+    def loads(self, data):
+        return self.msgpack.unpackb(data, raw=False, ext_hook=self._ext_hook)
+
+    def _default(self, obj):
+        if isinstance(obj, datetime):
+            return self.msgpack.ExtType(self.DATETIME_EXT, obj.isoformat().encode('ascii'))
+
+        raise TypeError('Object of type {:s} can not be cached'.format(type(obj).__name__))
+
+    def _ext_hook(self, code, data):
+        if code == self.DATETIME_EXT:
+            value = data.decode('ascii')
+            return datetime.strptime(value, DATETIME_FORMAT if '.' in value else DATETIME_FORMAT_NO_MS)
+
+        return self.msgpack.ExtType(code, data)
 
 
 try:
     import redis
 
     class RedisCache:
-        def __init__(self, client, prefix=''):
+        """
+        Cache in Redis shared by processes. Keys are namespaced by prefix, so clear removes only keys of this cache.
+        """
+        SCAN_BATCH_SIZE = 1000
+
+        def __init__(self, client=None, prefix='', codec=pickle, **connection_kwargs):
+            """
+            :param client: Redis client, if not set client with own connection pool is created
+            :param prefix: prefix of all keys, it's required to clear cache
+            :param codec: object with dumps and loads functions used to encode values, e.g. MsgpackCodec()
+            :param connection_kwargs: arguments of connection pool, e.g. host, port, db, max_connections
+            """
+            if client is None:
+                client = redis.Redis(connection_pool=redis.ConnectionPool(**connection_kwargs))
+
             self.client = client
             self.prefix = prefix
+            self.codec = codec
 
         def add(self, key, val, ttl=None):
-            ttl = ttl * 1000 if ttl else None
-            val = pickle.dumps(val)
-            self.client.set(self.prefix + key, val, px=ttl, nx=True)
+            return bool(self.client.set(self.prefix + key, self.codec.dumps(val), px=self._ttl_ms(ttl), nx=True))
 
         def set(self, key, val, ttl=None):
-            ttl = ttl * 1000 if ttl else None
-            val = pickle.dumps(val)
-            self.client.set(self.prefix + key, val, px=ttl * 1000)
+            self.client.set(self.prefix + key, self.codec.dumps(val), px=self._ttl_ms(ttl))
 
         def get(self, key):
             val = self.client.get(self.prefix + key)
             if val is None:
                 return None
 
-            return pickle.loads(val)
+            return self.codec.loads(val)
 
         def has(self, key):
-            return self.client.get(self.prefix + key) is not None
+            return self.client.exists(self.prefix + key) > 0
+
+        def get_many(self, keys):
+            """
+            :return: dictionary of found values by keys
+            """
+            keys = list(keys)
+            if not keys:
+                return {}
+
+            values = self.client.mget([self.prefix + key for key in keys])
+
+            return {key: self.codec.loads(val) for key, val in zip(keys, values) if val is not None}
+
+        def set_many(self, mapping, ttl=None):
+            pipe = self.client.pipeline(transaction=False)
+            px = self._ttl_ms(ttl)
+
+            for key, val in mapping.items():
+                pipe.set(self.prefix + key, self.codec.dumps(val), px=px)
+
+            pipe.execute()
 
         def remove(self, key):
-            self.client.delete(self.prefix + key)
+            self.client.unlink(self.prefix + key)
 
         def clear(self):
-            self.client.flushdb()
+            """
+            Remove all keys with prefix of the cache, other keys of the database are kept
+            """
+            if not self.prefix:
+                raise ValueError('Cache without prefix can not be cleared, it would remove all keys of database')
+
+            pattern = _escape_pattern(self.prefix) + '*'
+            batch = []
+
+            for key in self.client.scan_iter(match=pattern, count=self.SCAN_BATCH_SIZE):
+                batch.append(key)
+
+                if len(batch) >= self.SCAN_BATCH_SIZE:
+                    self.client.unlink(*batch)
+                    batch = []
+
+            if batch:
+                self.client.unlink(*batch)
+
+        @staticmethod
+        def _ttl_ms(ttl):
+            return int(ttl * 1000) if ttl is not None else None
+
+    def _escape_pattern(s):
+        for c in ('\\', '*', '?', '[', ']'):
+            s = s.replace(c, '\\' + c)
+
+        return s
 
 except ImportError:
     pass
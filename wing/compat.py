@@ -0,0 +1,48 @@
+"""
+Differences of falcon versions, WSGI application works with falcon 1.x and ASGI application requires falcon >= 3
+"""
+from datetime import timezone
+
+import falcon
+
+FALCON_MAJOR_VERSION = int(falcon.__version__.split('.')[0])
+
+try:
+    from falcon.app_helpers import prepare_middleware  # noqa: F401
+except ImportError:
+    from falcon.api_helpers import prepare_middleware  # noqa: F401
+
+
+def get_param_as_int(req, name, min_value=None, max_value=None):
+    if FALCON_MAJOR_VERSION >= 2:
+        return req.get_param_as_int(name, min_value=min_value, max_value=max_value)
+
+    return req.get_param_as_int(name, min=min_value, max=max_value)
+
+
+def if_none_match(req, etag):
+    """
+    Check If-None-Match header matches ETag, falcon >= 3 parses the header to list of ETag strings without quotes
+    """
+    value = req.if_none_match
+    if value is None:
+        return False
+
+    if isinstance(value, str):
+        return value == etag
+
+    if etag.startswith('W/'):
+        etag = etag[2:]
+
+    return any(tag == '*' or tag == etag.strip('"') for tag in value)
+
+
+def if_modified_since(req):
+    """
+    Date of If-Modified-Since header as naive UTC datetime, falcon >= 4 parses it to aware datetime
+    """
+    value = req.if_modified_since
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return value
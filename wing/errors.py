@@ -31,3 +31,15 @@ class NotNullFieldError(FieldValidationError):
 
 class IntegrityError(Exception):
     pass
+
+
+class RepeatedQueriesWarning(UserWarning):
+    pass
+
+
+class RepeatedQueriesError(Exception):
+    pass
+
+
+class ImproperlyConfigured(Exception):
+    pass
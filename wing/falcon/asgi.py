@@ -0,0 +1,312 @@
+"""
+ASGI application support, it requires falcon >= 3. Resources stay synchronous, their responders are run
+in bounded thread pool, so database queries and serialization of large bodies don't block event loop.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from .middlewares import HTTPCache, InstrumentationMiddleware, QueryCountMiddleware, ResponseStream
+from .resources import BODY_STREAM_KEY, MetricsResource
+from ..api import iter_resources, get_routes
+from ..instrumentation import TIMINGS_KEY, Timings, MetricsRegistry, activate
+from ..queries import QUERIES_KEY, QueryLog, start_capture, stop_capture
+from ..settings import ASGI_MAX_WORKERS, ASGI_STREAM_QUEUE_SIZE
+
+
+def register_api(app, api, executor=None):
+    """
+    Register API in falcon.asgi.App
+    :param executor: executor of resources calls, thread pool of ASGI_MAX_WORKERS threads by default
+    :return: executor
+    """
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=ASGI_MAX_WORKERS, thread_name_prefix='wing')
+
+    for prefix, resource in iter_resources(api):
+        register_resource(app, prefix, resource, executor)
+
+    return executor
+
+
+def register_resource(app, prefix, resource, executor):
+    for uri, falcon_resource in get_routes(prefix, resource):
+        app.add_route(uri, AsyncResource(falcon_resource, executor))
+
+    if resource._meta.http_cache and resource._meta.cache:
+        app.add_middleware(AsyncHTTPCache(resource._meta.cache, resource, executor))
+
+
+def register_metrics(app, registry=None, uri='/_metrics'):
+    """
+    Time stages of requests and expose their histograms in Prometheus text format
+    :param registry: MetricsRegistry, a new one is created by default
+    :param uri: URI of metrics, metrics route isn't added if it's None
+    :return: registry
+    """
+    if registry is None:
+        registry = MetricsRegistry()
+
+    app.add_middleware(AsyncInstrumentationMiddleware(registry))
+
+    if uri is not None:
+        app.add_route(uri, AsyncResource(MetricsResource(registry), None))
+
+    return registry
+
+
+class AsyncResource:
+    """
+    Asynchronous wrapper of falcon resource, responders are run in executor
+    """
+
+    def __init__(self, wrapped, executor):
+        self.wrapped = wrapped
+        self.executor = executor
+
+        # attributes used by middlewares
+        self.resource = getattr(wrapped, 'resource', None)
+        self.action = getattr(wrapped, 'action', None)
+
+        for name in dir(wrapped):
+            if name.startswith('on_') and callable(getattr(wrapped, name)):
+                setattr(self, name, self._create_responder(getattr(wrapped, name)))
+
+    def _create_responder(self, responder):
+        async def on_request(req, resp, **kwargs):
+            feeding = None
+            if req.method in ('POST', 'PUT', 'PATCH'):
+                body = BodyReader(asyncio.get_event_loop())
+                req.context[BODY_STREAM_KEY] = body
+                feeding = asyncio.ensure_future(body.feed(req.stream))
+
+            try:
+                await run_in_executor(self.executor, _call_in_context, req, responder, req, resp, **kwargs)
+            finally:
+                # responder may not read the whole body
+                if feeding is not None:
+                    feeding.cancel()
+
+            if resp.stream is not None and not hasattr(resp.stream, '__aiter__'):
+                # chunks are produced with timings and query log of request active in worker thread
+                stream = ResponseStream(resp.stream, partial(_call_in_context, req))
+                resp.stream = iterate_in_thread(self.executor, stream)
+
+        return on_request
+
+
+class AsyncHTTPCache(HTTPCache):
+    """
+    HTTPCache for ASGI application, cache and database calls are run in executor
+    """
+
+    def __init__(self, cache, resource, executor):
+        super(AsyncHTTPCache, self).__init__(cache, resource)
+        self.executor = executor
+
+    async def process_resource(self, req, resp, res, params):
+        if self.is_cacheable(req, res):
+            await run_in_executor(self.executor, _call_in_context, req,
+                                  super(AsyncHTTPCache, self).process_resource, req, resp, res, params)
+
+    async def process_response(self, req, resp, res, req_succeeded):
+        if self.etag_mode == 'content' and self.is_cacheable(req, res):
+            await run_in_executor(self.executor, super(AsyncHTTPCache, self).process_response, req, resp, res,
+                                  req_succeeded)
+
+
+class AsyncInstrumentationMiddleware(InstrumentationMiddleware):
+    """
+    InstrumentationMiddleware for ASGI application, timings are activated in worker threads by AsyncResource
+    """
+
+    async def process_request(self, req, resp):
+        req.context[TIMINGS_KEY] = Timings()
+
+    async def process_response(self, req, resp, res, req_succeeded):
+        timings = req.context.get(TIMINGS_KEY)
+        if timings is None:
+            return
+
+        self.set_header(resp, timings)
+
+        if hasattr(resp.stream, '__aiter__'):
+            resp.stream = FinishingStream(resp.stream, partial(self.observe, req, res, timings))
+        else:
+            self.observe(req, res, timings)
+
+
+class AsyncQueryCountMiddleware(QueryCountMiddleware):
+    """
+    QueryCountMiddleware for ASGI application, statements are captured in worker threads by AsyncResource
+    """
+
+    async def process_request(self, req, resp):
+        req.context[QUERIES_KEY] = QueryLog()
+
+    async def process_response(self, req, resp, res, req_succeeded):
+        queries = req.context.get(QUERIES_KEY)
+
+        if hasattr(resp.stream, '__aiter__'):
+            resp.stream = FinishingStream(resp.stream, partial(self.check, req, queries))
+        else:
+            self.check(req, queries)
+
+
+class FinishingStream:
+    """
+    Asynchronous iterator of streamed response body, finish is called once when the body is exhausted or closed
+    """
+
+    def __init__(self, stream, finish):
+        self.iterator = stream.__aiter__()
+        self.finish = finish
+        self.finished = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.iterator.__anext__()
+        except StopAsyncIteration:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.finished:
+            return
+
+        self.finished = True
+
+        try:
+            for name in ('aclose', 'close'):
+                close = getattr(self.iterator, name, None)
+                if close is not None:
+                    await close()
+                    break
+        finally:
+            self.finish()
+
+
+def _call_in_context(req, func, *args, **kwargs):
+    """
+    Call func with timings and query log of request active in the current thread
+    """
+    queries = req.context.get(QUERIES_KEY)
+    if queries is not None:
+        start_capture(queries)
+
+    activate(req.context.get(TIMINGS_KEY))
+
+    try:
+        return func(*args, **kwargs)
+    finally:
+        activate(None)
+
+        if queries is not None:
+            stop_capture(queries)
+
+
+async def run_in_executor(executor, func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(executor, partial(func, *args, **kwargs))
+
+
+class BodyReader:
+    """
+    File-like request body read by worker thread, chunks received by event loop are passed by bounded queue,
+    so the whole body isn't kept in memory when it's parsed lazily
+    """
+
+    def __init__(self, loop, queue_size=ASGI_STREAM_QUEUE_SIZE):
+        self.loop = loop
+        self.queue = asyncio.Queue(queue_size)
+        self.buffer = bytearray()
+        self.eof = False
+
+    async def feed(self, stream):
+        error = None
+
+        try:
+            async for chunk in stream:
+                await self.queue.put(chunk)
+        except Exception as e:
+            error = e
+
+        await self.queue.put(_End(error))
+
+    def read(self, size=-1):
+        while not self.eof and (size is None or size < 0 or len(self.buffer) < size):
+            item = asyncio.run_coroutine_threadsafe(self.queue.get(), self.loop).result()
+
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                self.eof = True
+            else:
+                self.buffer += item
+
+        if size is None or size < 0:
+            size = len(self.buffer)
+
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+
+        return data
+
+
+class _End:
+    def __init__(self, error=None):
+        self.error = error
+
+
+async def iterate_in_thread(executor, iterable, queue_size=ASGI_STREAM_QUEUE_SIZE):
+    """
+    Iterate synchronous iterable in one worker thread, database cursors of streamed queries can't be used
+    by other threads. Producer waits while queue is full, so memory is bounded for slow clients.
+    :return: asynchronous iterator
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue(queue_size)
+    state = {'stopped': False}
+
+    def put(item):
+        asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+
+    def produce():
+        iterator = iter(iterable)
+        error = None
+
+        try:
+            for chunk in iterator:
+                if state['stopped']:
+                    break
+
+                put(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+        if not state['stopped']:
+            put(_End(error))
+
+    loop.run_in_executor(executor, produce)
+
+    try:
+        while True:
+            item = await queue.get()
+
+            if isinstance(item, _End):
+                if item.error is not None:
+                    raise item.error
+                break
+
+            yield item
+    finally:
+        # unblock producer if client has gone
+        state['stopped'] = True
+        while not queue.empty():
+            queue.get_nowait()
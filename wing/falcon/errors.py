@@ -1,10 +1,10 @@
 import falcon
-from falcon import NoRepresentation, HTTPError
+from falcon import HTTPStatus
 
 
-class HTTPNotModified(NoRepresentation, HTTPError):
+class HTTPNotModified(HTTPStatus):
     """
-    304 Not Modified
+    304 Not Modified, it's raised as status instead of error, so no error body is written
     """
 
     def __init__(self, **kwargs):
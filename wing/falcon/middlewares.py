@@ -1,7 +1,22 @@
 import hashlib
-from datetime import datetime
+import warnings
+import zlib
+from functools import partial
+
+import falcon
 
 from .errors import HTTPNotModified
+from ..compat import if_none_match, if_modified_since
+from ..errors import DoesNotExist, RepeatedQueriesWarning, RepeatedQueriesError
+from ..instrumentation import TIMINGS_KEY, Timings, activate, server_timing, stage
+from ..queries import QUERIES_KEY, start_capture, stop_capture
+from ..serialization import get_serializer, depends_on_accept
+from ..settings import MAX_REPEATED_QUERIES
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
 
 
 def md5_hash(s):
@@ -10,43 +25,259 @@ def md5_hash(s):
     return h.hexdigest()
 
 
+def content_hash(data):
+    """
+    Fast non-cryptographic hash of response body
+    """
+    if xxhash is not None:
+        return xxhash.xxh64(data).hexdigest()
+
+    return '{:08x}{:08x}'.format(zlib.crc32(data), zlib.adler32(data))
+
+
 class HTTPCache:
-    CACHE_KEY = 'http_last_modify_date'
+    """
+    Conditional GET support for one resource. ETag mode is set by http_cache_etag option:
+    "version" derives validators from version of resource data, details routes use version of the requested
+    object, so writes to other objects don't invalidate it;
+    "content" hashes serialized body, so response is still built but unchanged body isn't sent;
+    "weak" derives weak ETag from max value of modification_field and count of objects selected by request.
+    """
 
     def __init__(self, cache, resource):
         self.cache = cache
         self.resource = resource
+        self.etag_mode = resource._meta.http_cache_etag
 
-        self.cache.add(self.CACHE_KEY, datetime.utcnow())
+    def process_resource(self, req, resp, res, params):
+        if not self.is_cacheable(req, res) or self.etag_mode == 'content':
+            return
+
+        with stage('http_cache'):
+            if self.etag_mode == 'weak':
+                validators = self.get_weak_validators(req, res, params)
+            else:
+                validators = self.get_version_validators(req, res, params)
 
-    def process_resource(self, req, resp, res):
-        if res is None or getattr(res, 'resource', None) is not self.resource:
+        if validators is None:
             return
 
-        if req.method.lower() != 'get':
-            self.cache.set(self.CACHE_KEY, datetime.utcnow())
+        etag, last_modify_date = validators
+
+        resp.etag = etag
+        if last_modify_date is not None:
+            resp.last_modified = last_modify_date
+
+        if self.is_not_modified(req, etag, last_modify_date):
+            raise HTTPNotModified(headers={'Vary': 'Accept'} if depends_on_accept(req) else None)
+
+    def process_response(self, req, resp, res, req_succeeded):
+        if self.etag_mode != 'content' or not req_succeeded or not self.is_cacheable(req, res):
             return
 
-        last_modify_date = self.get_last_modify_date()
-        etag = self.get_etag(req)
+        if resp.status != falcon.HTTP_200 or resp.stream is not None:
+            return
 
-        if req.if_modified_since:
-            modified_since = datetime.strptime(req.if_modified_since, '%a, %d %b %Y %H:%M:%S GMT')
-        else:
-            modified_since = None
+        if resp.data is None:
+            return
 
-        req_etag = req.if_none_match
+        etag = content_hash(resp.data)
 
         resp.etag = etag
-        resp.last_modified = last_modify_date
 
-        if (last_modify_date and modified_since and last_modify_date < modified_since) or (req_etag == etag):
-            raise HTTPNotModified()
+        if self.is_not_modified(req, etag, None):
+            resp.status = falcon.HTTP_304
+            resp.data = None
+
+    def is_cacheable(self, req, res):
+        return res is not None and getattr(res, 'resource', None) is self.resource and req.method in ('GET', 'HEAD')
+
+    def get_version_validators(self, req, res, params):
+        version = self.resource.get_version(self._get_pk(res, params))
+        if version is None:
+            return None
+
+        token, last_modify_date = version
+        return self.get_etag(req, token), last_modify_date
+
+    def get_weak_validators(self, req, res, params):
+        try:
+            last_modify_date, count = self.resource.get_modification_stats(req, res.action, **params)
+        except DoesNotExist:
+            return None
+
+        token = '{!s}:{:d}'.format(last_modify_date, count)
+        return 'W/"{:s}"'.format(self.get_etag(req, token)), last_modify_date
+
+    @staticmethod
+    def is_not_modified(req, etag, last_modify_date):
+        # If-Modified-Since is ignored if If-None-Match is sent (RFC 7232, section 6)
+        if req.if_none_match is not None:
+            return if_none_match(req, etag)
+
+        # falcon parses HTTP date of the header
+        modified_since = if_modified_since(req)
+
+        return bool(modified_since and last_modify_date and last_modify_date.replace(microsecond=0) <= modified_since)
+
+    @staticmethod
+    def get_etag(req, token):
+        # the same data serialized to other format must have other ETag
+        return md5_hash(token + req.path + req.query_string + get_serializer(req).content_type)
+
+    def _get_pk(self, res, params):
+        if getattr(res, 'action', None) != 'details':
+            return None
+
+        return params.get(self.resource._meta.primary_key)
+
+
+class InstrumentationMiddleware:
+    """
+    Time stages of every request, timings are sent in Server-Timing header and aggregated by registry.
+    Header of streamed response is sent before the body, so it has only timings of the responder, while
+    timings of the whole body are observed by registry when the stream is exhausted or closed.
+    """
+
+    def __init__(self, registry=None):
+        """
+        :param registry: MetricsRegistry, timings are only sent in header if it's not set
+        """
+        self.registry = registry
+
+    def process_request(self, req, resp):
+        timings = Timings()
+        req.context[TIMINGS_KEY] = timings
+        activate(timings)
+
+    def process_response(self, req, resp, res, req_succeeded):
+        activate(None)
+
+        timings = req.context.get(TIMINGS_KEY)
+        if timings is None:
+            return
+
+        self.set_header(resp, timings)
+
+        if is_streamed(resp):
+            resp.stream = ResponseStream(resp.stream, partial(_call_timed, timings),
+                                         partial(self.observe, req, res, timings))
+        else:
+            self.observe(req, res, timings)
+
+    @staticmethod
+    def set_header(resp, timings):
+        resp.set_header('Server-Timing', server_timing(timings, timings.total()))
+
+    def observe(self, req, res, timings):
+        resource = getattr(res, 'resource', None)
+        if self.registry is not None and resource is not None:
+            action = getattr(res, 'action', None) or 'custom'
+            self.registry.observe_timings(resource._meta.resource_name, action, req.method, timings, timings.total())
+
+
+class QueryCountMiddleware:
+    """
+    Capture SQL statements of every request and report statements shapes repeated more than max_repeats times,
+    it's meant for development and tests
+    """
+
+    def __init__(self, max_repeats=MAX_REPEATED_QUERIES, strict=False):
+        """
+        :param strict: raise RepeatedQueriesError instead of RepeatedQueriesWarning
+        """
+        self.max_repeats = max_repeats
+        self.strict = strict
+
+    def process_request(self, req, resp):
+        req.context[QUERIES_KEY] = start_capture()
+
+    def process_response(self, req, resp, res, req_succeeded):
+        queries = req.context.get(QUERIES_KEY)
+        if queries is None:
+            return
+
+        stop_capture(queries)
+
+        # statements of streamed body are executed after the responder
+        if is_streamed(resp):
+            resp.stream = ResponseStream(resp.stream, partial(_call_capturing, queries),
+                                         partial(self.check, req, queries))
+        else:
+            self.check(req, queries)
+
+    def check(self, req, queries):
+        repeated = queries.repeated(self.max_repeats) if queries is not None else None
+        if not repeated:
+            return
+
+        message = '{:s} {:s} executed {:d} queries, repeated statements:\n{:s}'.format(
+            req.method, req.path, len(queries),
+            '\n'.join('{:d}x {:s}'.format(count, shape) for shape, count in repeated))
+
+        if self.strict:
+            raise RepeatedQueriesError(message)
+
+        warnings.warn(message, RepeatedQueriesWarning)
+
+
+def is_streamed(resp):
+    """
+    Body is produced by iterator while it's sent, file-like streams are sent as they are
+    """
+    return resp.stream is not None and not hasattr(resp.stream, 'read')
+
+
+class ResponseStream:
+    """
+    Iterator of streamed response body, production of every chunk is run by call(func, *args), finish is called
+    once when the body is exhausted or closed
+    """
+
+    def __init__(self, stream, call, finish=None):
+        self.iterator = iter(stream)
+        self.call = call
+        self.finish = finish
+        self.finished = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self.call(next, self.iterator)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        if self.finished:
+            return
+
+        self.finished = True
+
+        try:
+            close = getattr(self.iterator, 'close', None)
+            if close is not None:
+                self.call(close)
+        finally:
+            if self.finish is not None:
+                self.finish()
+
+
+def _call_timed(timings, func, *args):
+    activate(timings)
+
+    try:
+        return func(*args)
+    finally:
+        activate(None)
 
-    def get_last_modify_date(self):
-        return self.cache.get(self.CACHE_KEY)
 
-    def get_etag(self, req):
-        last_modify_date = self.cache.get(self.CACHE_KEY)
+def _call_capturing(queries, func, *args):
+    start_capture(queries)
 
-        return md5_hash(last_modify_date.strftime('%Y-%m-%d %H:%M:%S') + req.path + req.query_string)
+    try:
+        return func(*args)
+    finally:
+        stop_capture(queries)
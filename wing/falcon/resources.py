@@ -1,6 +1,87 @@
+from collections.abc import Iterator
+
 import falcon
 
-from ..serialization import get_serializer
+from .middlewares import md5_hash
+from ..instrumentation import stage
+from ..serialization import get_serializer, get_deserializer, depends_on_accept
+
+BODY_STREAM_KEY = 'wing.body_stream'
+
+_END = object()
+
+
+def get_response_serializer(req, resp):
+    """
+    Serializer of response, Vary header is set if format is selected by Accept header
+    """
+    serializer = get_serializer(req)
+
+    if depends_on_accept(req):
+        resp.append_header('Vary', 'Accept')
+
+    return serializer
+
+
+def write_body(resp, serializer, result):
+    """
+    Write serialized result to response, serializers which produce bytes skip encoding of body
+    """
+    resp.content_type = serializer.content_type
+
+    with stage('serialize'):
+        dumpb = getattr(serializer, 'dumpb', None)
+        if dumpb is not None:
+            resp.data = dumpb(result)
+        else:
+            resp.data = serializer.dumps(result).encode('utf-8')
+
+
+def read_body(req, stream_items=False):
+    """
+    Parse request body with serializer selected by request
+    :param stream_items: parse list of items lazily if serializer supports it, iterator of items is returned then
+    """
+    serializer = get_deserializer(req)
+    iter_loads = getattr(serializer, 'iter_loads', None) if stream_items else None
+
+    # ASGI resources pass the body received by event loop to responder run in worker thread
+    stream = req.context.get(BODY_STREAM_KEY)
+    if stream is None:
+        stream = req.stream
+
+    try:
+        if iter_loads is not None:
+            with stage('parse'):
+                data = iter_loads(stream)
+
+            return _iter_items(data) if isinstance(data, Iterator) else data
+
+        with stage('parse'):
+            body = stream.read()
+            if not getattr(serializer, 'binary', False):
+                body = body.decode('utf-8')
+
+            return serializer.loads(body)
+    except ValueError:
+        raise falcon.HTTPBadRequest(title='Invalid format', description='Request body cannot be parsed')
+
+
+def _iter_items(items):
+    """
+    Iterate lazily parsed items, parsing of every item is timed as parse stage
+    """
+    try:
+        while True:
+            with stage('parse'):
+                item = next(items, _END)
+
+            if item is _END:
+                return
+
+            yield item
+    except ValueError:
+        raise falcon.HTTPBadRequest(title='Invalid format', description='Request body cannot be parsed')
 
 
 class BaseFalconResource:
@@ -11,12 +92,51 @@ class BaseFalconResource:
         if not self.resource.is_method_allowed(method, action):
             raise falcon.HTTPMethodNotAllowed(self.resource.get_allowed_methods(action))
 
+    def _get_response_cache_key(self, req, serializer, pk=None):
+        """
+        Key of serialized response in cache, it includes version of resource data
+        :param pk: primary key of requested object
+        :return: key or None if response cache is disabled
+        """
+        if not self.resource._meta.response_cache:
+            return None
+
+        version = self.resource.get_version(pk)
+        if version is None:
+            return None
+
+        return '{:s}:response:{:s}'.format(self.resource._meta.resource_name, md5_hash(
+            version[0] + req.path + '?' + req.query_string + serializer.content_type))
+
+    def _read_cached_response(self, key, resp):
+        """
+        Write response from cache
+        :return: True if response was found in cache
+        """
+        if key is None:
+            return False
+
+        cached = self.resource._meta.cache.get(key)
+        if cached is None:
+            return False
+
+        resp.content_type, resp.data = cached
+        return True
+
+    def _store_response(self, key, resp):
+        if key is None or resp.data is None:
+            return
+
+        self.resource._meta.cache.set(key, (resp.content_type, resp.data), self.resource._meta.response_cache_ttl)
+
 
 class CollectionFalconResource(BaseFalconResource):
     """
     Objects collection base resource
     """
 
+    action = 'list'
+
     def on_get(self, req, resp, **kwargs):
         """
         Get objects list
@@ -24,11 +144,22 @@ class CollectionFalconResource(BaseFalconResource):
         :param resp: response object
         """
         self._check_method('get', 'list')
+        serializer = get_response_serializer(req, resp)
+
+        cache_key = self._get_response_cache_key(req, serializer)
+        if self._read_cached_response(cache_key, resp):
+            return
+
+        if self.resource._meta.stream and hasattr(serializer, 'iter_dumps'):
+            meta, objects = self.resource.iter_list(req, **kwargs)
+            resp.content_type = serializer.content_type
+            resp.stream = serializer.iter_dumps(meta, objects)
+            return
 
         result = self.resource.get_list(req, **kwargs)
-        serializer = get_serializer(req)
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(result)
+        write_body(resp, serializer, result)
+
+        self._store_response(cache_key, resp)
 
     def on_post(self, req, resp, **kwargs):
         """
@@ -37,43 +168,57 @@ class CollectionFalconResource(BaseFalconResource):
         :param resp: response object
         """
         self._check_method('post', 'list')
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
 
-        try:
-            req.context['data'] = serializer.loads(req.stream.read().decode('utf-8'))
-        except ValueError:
-            raise falcon.HTTPBadRequest('Invalid format', 'Request body cannot be parsed')
+        req.context['data'] = read_body(req, stream_items=self.resource._meta.stream_body)
 
         result = self.resource.post_list(req, **kwargs)
+        self.resource.touch()
 
         resp.status = falcon.HTTP_201
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(result)
+        write_body(resp, serializer, result)
 
     def on_put(self, req, resp, **kwargs):
         self._check_method('put', 'list')
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
 
-        try:
-            req.context['data'] = serializer.loads(req.stream.read().decode('utf-8'))
-        except ValueError:
-            raise falcon.HTTPBadRequest('Invalid format', 'Request body cannot be parsed')
+        req.context['data'] = read_body(req, stream_items=self.resource._meta.stream_body)
 
         results = self.resource.put_list(req, **kwargs)
+        self.resource.touch()
 
         resp.status = falcon.HTTP_200
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(results)
+        write_body(resp, serializer, results)
 
     def on_delete(self, req, resp, **kwargs):
         self._check_method('delete', 'list')
 
         results = self.resource.delete_list(req, **kwargs)
+        self.resource.touch()
 
         resp.status = falcon.HTTP_204
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
+        write_body(resp, serializer, results)
+
+
+class ExportFalconResource(BaseFalconResource):
+    """
+    Export of all objects selected by filters, the response is streamed while objects are fetched
+    """
+
+    action = 'export'
+
+    def on_get(self, req, resp, **kwargs):
+        self._check_method('get', 'list')
+        serializer = get_response_serializer(req, resp)
+
+        if not hasattr(serializer, 'iter_dumps'):
+            raise falcon.HTTPNotAcceptable(description='Format can not be used for export')
+
+        objects = self.resource.export(req, **kwargs)
+
         resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(results)
+        resp.stream = serializer.iter_dumps({}, objects)
 
 
 class ItemFalconResource(BaseFalconResource):
@@ -81,6 +226,11 @@ class ItemFalconResource(BaseFalconResource):
     Object item base resource
     """
 
+    action = 'details'
+
+    def _get_pk(self, kwargs):
+        return kwargs.get(self.resource._meta.primary_key)
+
     def on_get(self, req, resp, **kwargs):
         """
         Show object details
@@ -89,13 +239,18 @@ class ItemFalconResource(BaseFalconResource):
         :param resp: response object
         """
         self._check_method('get', 'details')
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
+
+        cache_key = self._get_response_cache_key(req, serializer, self._get_pk(kwargs))
+        if self._read_cached_response(cache_key, resp):
+            return
 
         result = self.resource.get_details(req, **kwargs)
 
         resp.status = falcon.HTTP_200
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(result)
+        write_body(resp, serializer, result)
+
+        self._store_response(cache_key, resp)
 
     def on_put(self, req, resp, **kwargs):
         """
@@ -105,18 +260,15 @@ class ItemFalconResource(BaseFalconResource):
         :param resp: response object
         """
         self._check_method('put', 'details')
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
 
-        try:
-            req.context['data'] = serializer.loads(req.stream.read().decode('utf-8'))
-        except ValueError:
-            raise falcon.HTTPBadRequest('Invalid format', 'Request body cannot be parsed')
+        req.context['data'] = read_body(req)
 
         result = self.resource.put_details(req, **kwargs)
+        self.resource.touch(self._get_pk(kwargs))
 
         resp.status = falcon.HTTP_200
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(result)
+        write_body(resp, serializer, result)
 
     def on_delete(self, req, resp, **kwargs):
         """
@@ -126,26 +278,47 @@ class ItemFalconResource(BaseFalconResource):
         :param resp: response object
         """
         self._check_method('delete', 'details')
-        serializer = get_serializer(req)
+        serializer = get_response_serializer(req, resp)
 
         result = self.resource.delete_details(req, **kwargs)
+        self.resource.touch(self._get_pk(kwargs))
 
         resp.status = falcon.HTTP_204
-        resp.content_type = serializer.content_type
-        resp.body = serializer.dumps(result)
+        write_body(resp, serializer, result)
+
+
+class MetricsResource:
+    """
+    Metrics of registry in Prometheus text format
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+
+    def on_get(self, req, resp):
+        resp.content_type = 'text/plain; version=0.0.4'
+        resp.data = self.registry.render().encode('utf-8')
 
 
 class FunctionResource:
     pass
 
 
-def resource_func(func):
+def resource_func(func, touch=False):
+    """
+    :param touch: change version of resource data after call
+    """
+    resource = getattr(func, '__self__', None)
+
     def wrapper(req, resp, *args, **kwargs):
         result = func(req, resp, *args, **kwargs)
 
+        if touch and resource is not None:
+            resource.touch()
+
         if result is not None:
-            serializer = get_serializer(req)
-            resp.body = serializer.dumps(result)
+            serializer = get_response_serializer(req, resp)
+            write_body(resp, serializer, result)
 
     return wrapper
 
@@ -156,6 +329,6 @@ def create_func_resource(func, http_methods):
     for http_method in http_methods:
         method = 'on_' + http_method
 
-        setattr(resource, method, resource_func(func))
+        setattr(resource, method, resource_func(func, touch=http_method.lower() != 'get'))
 
     return resource
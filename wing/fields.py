@@ -2,6 +2,7 @@ from datetime import datetime
 from urllib.parse import urlparse
 
 from .errors import DoesNotExist, InvalidValue
+from .settings import MAX_IN_VALUES
 
 
 class Field(object):
@@ -17,7 +18,7 @@ class Field(object):
         self.readonly = readonly
         self.required = required
         self.null = null
-        self.show = show
+        self.show = frozenset(show)
         self.pk = pk
 
     def hydrate(self, obj, value):
@@ -36,9 +37,22 @@ class Field(object):
     def convert(self, value):
         return value
 
+    def convert_filter(self, value):
+        """
+        Convert value of filter parameter to type of database column
+        """
+        return self.convert(value)
+
     def convert_name(self, name):
         return name
 
+    @property
+    def direct_attribute(self):
+        """
+        Attribute which dehydrates as is, None if dehydrate does something more
+        """
+        return self.attribute if type(self).dehydrate is Field.dehydrate else None
+
 
 class CharField(Field):
     pass
@@ -58,7 +72,7 @@ class IntegerField(Field):
 
 class BooleanField(Field):
     def convert(self, value):
-        return bool(value)
+        return parse_bool(value)
 
 
 class DateTimeField(Field):
@@ -83,8 +97,8 @@ class DateField(DateTimeField):
         if value is None:
             return None
         try:
-            return super(DateField, self).date()
-        except:
+            return datetime.strptime(value, self.format).date()
+        except (TypeError, ValueError):
             raise InvalidValue('Invalid date format')
 
 
@@ -102,33 +116,68 @@ class URLField(CharField):
 
 
 class ForeignKeyField(Field):
-    def __init__(self, attribute, rel_resource, *args, **kwargs):
+    def __init__(self, attribute, rel_resource, *args, full=False, id_attribute=None, **kwargs):
+        """
+        :param full: dehydrate whole related object instead of its primary key
+        :param id_attribute: attribute holding raw foreign key value, it's detected by model resource adapter
+        """
         super(ForeignKeyField, self).__init__(attribute, *args, **kwargs)
 
         self.rel_resource = rel_resource
+        self.full = full
+        self.id_attribute = id_attribute
 
-    def hydrate(self, obj, value):
+    def hydrate(self, obj, value, related=None):
         """hydrate field to object"""
         if self.readonly:
             return
 
-        value = self.convert(value)
+        value = self.convert(value, related)
 
         setattr(obj, self.attribute, value)
 
     def dehydrate(self, obj):
         """dehydrate field from object"""
+        if not self.full and self.id_attribute:
+            # raw key value, related object is not loaded
+            return getattr(obj, self.id_attribute)
+
         rel_obj = getattr(obj, self.attribute)
+        if rel_obj is None:
+            return None
+
+        if self.full:
+            return _resource_instance(self.rel_resource).dehydrate(rel_obj, None)
 
         # return getattr(rel_obj, self.rel_resource._meta.primary_key) if rel_obj is not None else None
-        return getattr(rel_obj, self.rel_resource._meta.pk_) if rel_obj is not None else None
+        return getattr(rel_obj, self.rel_resource._meta.pk_)
+
+    @property
+    def direct_attribute(self):
+        if self.full or type(self).dehydrate is not ForeignKeyField.dehydrate:
+            return None
+
+        return self.id_attribute
+
+    def convert(self, value, related=None):
+        """
+        Find related object by primary key
+        :param related: dictionary of already fetched related objects, see resolve
+        """
+        if value is None:
+            return None
 
-    def convert(self, value):
         # rel_pk = self.rel_resource._meta.primary_key
         rel_pk = self.rel_resource._meta.pk_
         rel_field = self.rel_resource.fields[rel_pk]
 
-        filters = self.rel_resource._filters_from_kwargs(**{rel_pk: rel_field.convert(value)})
+        value = rel_field.convert(value)
+
+        # object missing in related may be created by previous item of the same data
+        if related is not None and value in related:
+            return related[value]
+
+        filters = self.rel_resource._filters_from_kwargs(**{rel_pk: value})
         qs = self.rel_resource.db.select(filters)[:1]
 
         if len(qs) == 0:
@@ -136,6 +185,38 @@ class ForeignKeyField(Field):
 
         return qs[0]
 
+    def convert_filter(self, value):
+        """
+        Convert filter value to primary key of related resource without fetching related object
+        """
+        rel_resource = self.rel_resource
+        return rel_resource.fields[rel_resource._meta.pk_].convert(value)
+
+    def resolve(self, values):
+        """
+        Fetch related objects for many values with one query per MAX_IN_VALUES values
+        :param values: related primary keys
+        :return: dictionary of related objects by primary key
+        """
+        rel_pk = self.rel_resource._meta.pk_
+        rel_field = self.rel_resource.fields[rel_pk]
+
+        keys = set()
+        for value in values:
+            try:
+                keys.add(rel_field.convert(value))
+            except (ValueError, TypeError):
+                # invalid value will be reported by convert
+                continue
+
+        keys = list(keys)
+        related = {}
+        for i in range(0, len(keys), MAX_IN_VALUES):
+            for rel_obj in self.rel_resource.db.select([(rel_pk, 'in', keys[i:i + MAX_IN_VALUES])]):
+                related[getattr(rel_obj, rel_pk)] = rel_obj
+
+        return related
+
     def convert_name(self, name):
         name = "{:}_{:}".format(self.rel_resource._meta.primary_key, self.rel_resource._meta.pk_)
         return name
@@ -146,7 +227,7 @@ class ToManyField(Field):
         super(ToManyField, self).__init__(attribute, *args, **kwargs)
 
         self.rel_resource = rel_resource
-        self.rel_pk = rel_resource._meta.primary_key
+        self.rel_pk = rel_resource._meta.pk_
         self.full = full
 
     def dehydrate(self, obj):
@@ -156,9 +237,39 @@ class ToManyField(Field):
 
     def dehydrate_rel_obj(self, rel_obj):
         if self.full:
-            return self.rel_resource.dehydrate(rel_obj, None)
+            return _resource_instance(self.rel_resource).dehydrate(rel_obj, None)
         else:
             return getattr(rel_obj, self.rel_pk)
 
     def hydrate(self, obj, value):
         raise NotImplemented
+
+
+_TRUE_VALUES = frozenset(('1', 'true', 't', 'yes', 'y', 'on'))
+
+_FALSE_VALUES = frozenset(('0', 'false', 'f', 'no', 'n', 'off', ''))
+
+
+def parse_bool(value):
+    """
+    Convert value to bool, strings are parsed as query parameters
+    """
+    if isinstance(value, str):
+        lowered = value.strip().lower()
+
+        if lowered in _TRUE_VALUES:
+            return True
+
+        if lowered in _FALSE_VALUES:
+            return False
+
+        raise InvalidValue('Invalid boolean value')
+
+    return bool(value)
+
+
+def _resource_instance(resource):
+    """
+    Related resource may be passed as class
+    """
+    return resource() if isinstance(resource, type) else resource
@@ -0,0 +1,172 @@
+"""
+Timing of request processing stages. Stages are timed only while timings of a request are active
+in the current thread, otherwise stage() costs one attribute lookup.
+"""
+import threading
+from collections import OrderedDict
+from functools import wraps
+from time import perf_counter
+
+TIMINGS_KEY = 'wing.timings'
+
+# upper bounds of histogram buckets in seconds
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Timings:
+    """
+    Durations of stages of one request, durations of repeated stages are summed
+    """
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.stages = OrderedDict()
+        self.running = set()
+
+    def add(self, name, duration):
+        self.stages[name] = self.stages.get(name, 0.0) + duration
+
+    def total(self):
+        return perf_counter() - self.started
+
+
+class _Stage:
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.timings.running.add(self.name)
+        self.start = perf_counter()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.timings.add(self.name, perf_counter() - self.start)
+        self.timings.running.discard(self.name)
+
+
+class _NoopStage:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NOOP_STAGE = _NoopStage()
+
+
+def stage(name):
+    """
+    Context manager which adds duration of its block to active timings, nested block of the same stage
+    isn't timed twice
+    """
+    timings = getattr(_local, 'timings', None)
+
+    if timings is None or name in timings.running:
+        return _NOOP_STAGE
+
+    return _Stage(timings, name)
+
+
+def timed(name):
+    """
+    Decorator which times function calls as stage
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def activate(timings):
+    """
+    Make timings active in the current thread
+    :param timings: Timings or None to deactivate
+    """
+    _local.timings = timings
+
+
+class MetricsRegistry:
+    """
+    Histograms of stage durations by resource, action and method, rendered in Prometheus text format
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, name='wing_stage_duration_seconds'):
+        self.buckets = tuple(sorted(buckets))
+        self.name = name
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, duration):
+        """
+        :param labels: tuple of label name and value pairs
+        :param duration: duration in seconds
+        """
+        with self.lock:
+            histogram = self.histograms.get(labels)
+            if histogram is None:
+                histogram = self.histograms[labels] = [[0] * len(self.buckets), 0.0, 0]
+
+            counts = histogram[0]
+            for i, bound in enumerate(self.buckets):
+                if duration <= bound:
+                    counts[i] += 1
+                    break
+
+            histogram[1] += duration
+            histogram[2] += 1
+
+    def observe_timings(self, resource, action, method, timings, total):
+        for stage_name, duration in list(timings.stages.items()) + [('total', total)]:
+            labels = (('resource', resource), ('action', action), ('method', method), ('stage', stage_name))
+            self.observe(labels, duration)
+
+    def render(self):
+        lines = [
+            '# HELP {:s} Duration of request processing stages'.format(self.name),
+            '# TYPE {:s} histogram'.format(self.name),
+        ]
+
+        with self.lock:
+            histograms = sorted((labels, (list(counts), total, count))
+                                for labels, (counts, total, count) in self.histograms.items())
+
+        for labels, (counts, total, count) in histograms:
+            label_str = ','.join('{:s}="{:s}"'.format(name, _escape(value)) for name, value in labels)
+
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append('{:s}_bucket{{{:s},le="{!r}"}} {:d}'.format(self.name, label_str, bound, cumulative))
+
+            lines.append('{:s}_bucket{{{:s},le="+Inf"}} {:d}'.format(self.name, label_str, count))
+            lines.append('{:s}_sum{{{:s}}} {!r}'.format(self.name, label_str, total))
+            lines.append('{:s}_count{{{:s}}} {:d}'.format(self.name, label_str, count))
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+def server_timing(timings, total):
+    """
+    Value of Server-Timing header, durations are in milliseconds
+    """
+    entries = list(timings.stages.items()) + [('total', total)]
+
+    return ', '.join('{:s};dur={:.3f}'.format(name, duration * 1000) for name, duration in entries)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
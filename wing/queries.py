@@ -0,0 +1,127 @@
+"""
+Capture of SQL statements executed in the current thread. Statements are taken from debug records of peewee
+logger, the logger is enabled only while some capture is active, and records are passed to its handlers
+only if they were enabled before.
+"""
+import logging
+import re
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+QUERIES_KEY = 'wing.queries'
+
+LOGGER_NAME = 'peewee'
+
+# lists of placeholders of IN conditions and multi-row inserts
+_PLACEHOLDER_LIST = re.compile(r'(\?|%s)(?:\s*,\s*(?:\?|%s))+')
+
+_local = threading.local()
+_lock = threading.Lock()
+_state = {'active': 0, 'filter': None, 'level': logging.NOTSET}
+
+
+class QueryLog:
+    """
+    SQL statements with parameters executed while capture was active
+    """
+
+    def __init__(self):
+        self.queries = []
+
+    def __len__(self):
+        return len(self.queries)
+
+    def __iter__(self):
+        return iter(self.queries)
+
+    def shapes(self):
+        """
+        :return: Counter of statements shapes
+        """
+        return Counter(statement_shape(sql) for sql, params in self.queries)
+
+    def repeated(self, max_repeats):
+        """
+        Statements shapes executed more than max_repeats times, it's a sign of N+1 queries
+        :return: list of shape and count pairs, the most repeated first
+        """
+        return [(shape, count) for shape, count in self.shapes().most_common() if count > max_repeats]
+
+
+def statement_shape(sql):
+    """
+    Statement with lists of placeholders collapsed, so IN conditions with different count of values
+    have the same shape
+    """
+    return _PLACEHOLDER_LIST.sub(r'\1, ...', sql)
+
+
+class _CaptureFilter(logging.Filter):
+    def __init__(self, level):
+        super(_CaptureFilter, self).__init__()
+        self.level = level
+
+    def filter(self, record):
+        logs = getattr(_local, 'logs', None)
+        if logs and isinstance(record.msg, tuple) and len(record.msg) == 2:
+            for log in logs:
+                log.queries.append(record.msg)
+
+        return record.levelno >= self.level
+
+
+def start_capture(log=None):
+    """
+    Start capture of statements executed in the current thread
+    :param log: QueryLog to append statements to, a new one is created by default
+    :return: log
+    """
+    if log is None:
+        log = QueryLog()
+
+    logger = logging.getLogger(LOGGER_NAME)
+    with _lock:
+        if not _state['active']:
+            _state['level'] = logger.level
+            _state['filter'] = _CaptureFilter(logger.getEffectiveLevel())
+            logger.addFilter(_state['filter'])
+            logger.setLevel(logging.DEBUG)
+
+        _state['active'] += 1
+
+    if not hasattr(_local, 'logs'):
+        _local.logs = []
+    _local.logs.append(log)
+
+    return log
+
+
+def stop_capture(log):
+    """
+    Stop capture started by start_capture
+    """
+    _local.logs.remove(log)
+
+    logger = logging.getLogger(LOGGER_NAME)
+    with _lock:
+        _state['active'] -= 1
+
+        if not _state['active']:
+            logger.removeFilter(_state['filter'])
+            logger.setLevel(_state['level'])
+            _state['filter'] = None
+
+
+@contextmanager
+def capture_queries():
+    """
+    Capture statements executed in the current thread within block
+    :return: context manager which gives QueryLog
+    """
+    log = start_capture()
+
+    try:
+        yield log
+    finally:
+        stop_capture(log)
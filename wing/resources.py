@@ -1,11 +1,22 @@
+import base64
+import json
+import keyword
+from collections.abc import Iterator
 from copy import copy
+from datetime import datetime
+from itertools import chain, islice
+from uuid import uuid4
 
 import falcon
 
 from .adapters import detect_adapter
-from .errors import DoesNotExist, MissingRequiredFieldError, NotNullFieldError, FieldValidationError, IntegrityError
-from .fields import Field
-from .settings import DEFAULT_MAX_LIMIT, DEFAULT_LIMIT
+from .compat import get_param_as_int
+from .errors import DoesNotExist, MissingRequiredFieldError, NotNullFieldError, FieldValidationError, \
+    IntegrityError, InvalidValue, ImproperlyConfigured
+from .fields import Field, ForeignKeyField, ToManyField, parse_bool
+from .instrumentation import stage, timed
+from .settings import DEFAULT_MAX_LIMIT, DEFAULT_LIMIT, DEFAULT_COUNT_CACHE_TTL, MAX_COMPILED_DEHYDRATORS, \
+    MAX_IN_VALUES, DEFAULT_RESPONSE_CACHE_TTL, OBJECT_VERSION_TTL, BULK_CHUNK_SIZE
 
 
 def custom_method(uri, http_methods=None):
@@ -24,6 +35,38 @@ def custom_method(uri, http_methods=None):
     return wrapper
 
 
+def _compile_dehydrator(fields, sender, names=None):
+    """
+    Build function which dehydrates object with fields shown for sender,
+    fields without own dehydrate logic are read as plain attributes
+    :param fields: dictionary of resource fields
+    :param sender: sender name or None for all fields
+    :param names: names of fields to dehydrate or None for all fields
+    """
+    namespace = {}
+    items = []
+    for i, (key, field) in enumerate(fields.items()):
+        if (sender is not None and sender not in field.show) or (names is not None and key not in names):
+            continue
+
+        attribute = field.direct_attribute
+        if attribute is not None:
+            if attribute.isidentifier() and not keyword.iskeyword(attribute):
+                items.append('{!r}: obj.{:s}'.format(key, attribute))
+            else:
+                # the same as getattr of Field.dehydrate, dotted names are not followed
+                items.append('{!r}: getattr(obj, {!r})'.format(key, attribute))
+            continue
+
+        getter = 'f{:d}'.format(i)
+        namespace[getter] = field.dehydrate
+        items.append('{!r}: {:s}(obj)'.format(key, getter))
+
+    exec('def dehydrate(obj):\n    return {{{:s}}}\n'.format(', '.join(items)), namespace)
+
+    return namespace['dehydrate']
+
+
 class ResourceOptions(object):
     allowed_methods = ['get', 'post', 'put', 'delete', 'patch']
     list_allowed_methods = None
@@ -33,13 +76,27 @@ class ResourceOptions(object):
     resource_name = None
     filtering = {}
     ordering = []
+    pagination = 'offset'
+    statement_cache = True
+    count = 'exact'
+    count_cache_ttl = DEFAULT_COUNT_CACHE_TTL
+    stream = False
+    stream_body = False
+    export = False
     object_class = None
     excludes = []
     primary_key = 'id'
     pk_ = 'id'
     adapter = None
     http_cache = False
+    http_cache_etag = 'version'
+    modification_field = None
     cache = None
+    response_cache = False
+    response_cache_ttl = DEFAULT_RESPONSE_CACHE_TTL
+    bulk = False
+    bulk_chunk_size = BULK_CHUNK_SIZE
+    upsert = False
 
     def __new__(cls, meta=None):
         overrides = {}
@@ -82,8 +139,35 @@ class DeclarativeMetaclass(type):
             if getattr(func, 'type', None) is not None:
                 new_class.custom_methods.append((func_name, func_uri, func_http_methods))
 
+        mcs.compile_dehydrators(new_class)
+        mcs.compile_filters(new_class)
+
         return new_class
 
+    @staticmethod
+    def compile_dehydrators(new_class):
+        new_class._dehydrators = {sender: _compile_dehydrator(new_class.fields, sender)
+                                  for sender in (None, 'list', 'details')}
+
+    @staticmethod
+    def compile_filters(new_class):
+        """
+        Build filter plan which maps query parameter to field name, filter type and value converter,
+        so request parameters are resolved with one lookup each
+        """
+        plan = {}
+        for name, filter_types in new_class._meta.filtering.items():
+            field = new_class.fields.get(name)
+
+            for filter_type in filter_types:
+                entry = (name, filter_type, _create_filter_converter(field, filter_type))
+                plan['{:s}__{:s}'.format(name, filter_type)] = entry
+
+                if filter_type == 'exact':
+                    plan[name] = entry
+
+        new_class._filter_plan = plan
+
 
 class ModelDeclarativeMetaclass(DeclarativeMetaclass):
     def __new__(mcs, name, bases, attrs):
@@ -97,14 +181,48 @@ class ModelDeclarativeMetaclass(DeclarativeMetaclass):
 
             new_class.fields.update(new_class.db.get_fields(new_class._meta.excludes + list(new_class.fields.keys())))
 
+            for field in new_class.fields.values():
+                if isinstance(field, ForeignKeyField) and field.id_attribute is None:
+                    field.id_attribute = new_class.db.get_fk_id_attribute(field.attribute,
+                                                                          field.rel_resource._meta.pk_)
+
+            mcs.compile_dehydrators(new_class)
+            mcs.compile_filters(new_class)
+            mcs.check_options(new_class)
+
         return new_class
 
+    @staticmethod
+    def check_options(new_class):
+        """
+        Reject combinations of options which would fail on every request
+        """
+        meta = new_class._meta
+
+        if meta.pagination == 'cursor' and any(name.lstrip('-') != meta.pk_ for name in meta.ordering):
+            raise ImproperlyConfigured('{:s}: cursor pagination orders objects only by primary key "{:s}", '
+                                       'ordering {!r} is not supported'.format(new_class.__name__, meta.pk_,
+                                                                               list(meta.ordering)))
+
+        if meta.http_cache_etag == 'weak':
+            if not meta.modification_field:
+                raise ImproperlyConfigured('{:s}: weak ETag requires modification_field option'.format(
+                    new_class.__name__))
+
+            if not new_class.db.has_attribute(meta.modification_field):
+                raise ImproperlyConfigured('{:s}: modification field "{:s}" is not attribute of {:s}'.format(
+                    new_class.__name__, meta.modification_field, meta.object_class.__name__))
+
 
 class Resource(metaclass=DeclarativeMetaclass):
     _meta = None
 
     fields = None
 
+    _dehydrators = None
+
+    _filter_plan = None
+
     def is_method_allowed(self, method, action):
         return method in self.get_allowed_methods(action)
 
@@ -116,9 +234,94 @@ class Resource(metaclass=DeclarativeMetaclass):
         else:
             return self._meta.allowed_methods
 
+    @classmethod
+    def get_version(cls, pk=None):
+        """
+        Version of resource data kept in cache, it changes on every write to the resource
+        and to resources of its full and to-many relations
+        :param pk: primary key to get version of one object instead of the whole resource
+        :return: tuple of version token and modification date or None if cache isn't set
+        """
+        if cls._meta.cache is None:
+            return None
+
+        if pk is None:
+            keys = [(cls, cls._get_version_key(), None)]
+        else:
+            # writes to the list may change any object
+            keys = [(cls, cls._get_version_key('object:{!s}'.format(pk)), OBJECT_VERSION_TTL),
+                    (cls, cls._get_version_key('list'), None)]
+
+        for rel_resource in cls._get_dependencies():
+            if rel_resource._meta.cache is not None:
+                keys.append((rel_resource, rel_resource._get_version_key(), None))
+
+        # one round trip per cache, missing versions are created one by one
+        caches = {id(resource._meta.cache): resource._meta.cache for resource, key, ttl in keys}
+        found = {}
+        for cache_id, cache in caches.items():
+            values = cache.get_many([key for resource, key, ttl in keys if resource._meta.cache is cache])
+            found.update(((cache_id, key), version) for key, version in values.items())
+
+        versions = [found.get((id(resource._meta.cache), key)) or resource._get_stored_version(key, ttl)
+                    for resource, key, ttl in keys]
+
+        return ''.join(token for token, date in versions), max(date for token, date in versions)
+
+    @classmethod
+    def touch(cls, pk=None):
+        """
+        Change version of resource data after write
+        :param pk: primary key of changed object or None if any object may be changed
+        """
+        cache = cls._meta.cache
+        if cache is None:
+            return
+
+        version = (uuid4().hex, datetime.utcnow())
+
+        cache.set(cls._get_version_key(), version)
+
+        if pk is None:
+            cache.set(cls._get_version_key('list'), version)
+        else:
+            cache.set(cls._get_version_key('object:{!s}'.format(pk)), version, OBJECT_VERSION_TTL)
+
+    @classmethod
+    def _get_stored_version(cls, key, ttl=None):
+        cache = cls._meta.cache
+        version = cache.get(key)
+
+        if version is None:
+            version = (uuid4().hex, datetime.utcnow())
+
+            if not cache.add(key, version, ttl):
+                version = cache.get(key) or version
+
+        return version
+
+    @classmethod
+    def _get_version_key(cls, suffix=None):
+        key = '{:s}:version'.format(cls._meta.resource_name)
+        return key if suffix is None else '{:s}:{!s}'.format(key, suffix)
+
+    @classmethod
+    def _get_dependencies(cls):
+        """
+        Resources which data is included to dehydrated objects
+        """
+        return [field.rel_resource for field in cls.fields.values()
+                if isinstance(field, ToManyField) or (isinstance(field, ForeignKeyField) and field.full)]
+
     def get_list(self, req, **kwargs):
         raise NotImplemented
 
+    def iter_list(self, req, **kwargs):
+        raise NotImplementedError
+
+    def export(self, req, **kwargs):
+        raise NotImplementedError
+
     def post_list(self, req, **kwargs):
         raise NotImplemented
 
@@ -137,20 +340,32 @@ class Resource(metaclass=DeclarativeMetaclass):
     def delete_details(self, req, **kwargs):
         raise NotImplemented
 
-    def dehydrate(self, obj, sender=None):
+    def dehydrate(self, obj, sender=None, fields=None):
         """
         Dehydrate object
         :param obj: object
         :param sender: tuple
+        :param fields: names of fields to dehydrate, all fields shown for sender by default
         """
-        return {key: field.dehydrate(obj) for key, field in self.fields.items() if
-                sender is None or (sender in field.show)}
+        key = sender if fields is None else (sender, frozenset(fields))
+
+        try:
+            dehydrator = self._dehydrators[key]
+        except KeyError:
+            dehydrator = _compile_dehydrator(self.fields, sender, fields)
 
-    def hydrate(self, obj, data):
+            if len(self._dehydrators) < MAX_COMPILED_DEHYDRATORS:
+                self._dehydrators[key] = dehydrator
+
+        return dehydrator(obj)
+
+    @timed('hydrate')
+    def hydrate(self, obj, data, related=None):
         """
         Hydrate data to object
         :param obj: object
         :param data: data as dictionary
+        :param related: related objects fetched by resolve_related
         """
         try:
             for key, field in self.fields.items():
@@ -169,24 +384,64 @@ class Resource(metaclass=DeclarativeMetaclass):
                     raise NotNullFieldError(key)
 
                 try:
-                    field.hydrate(obj, value)
+                    if related and key in related:
+                        field.hydrate(obj, value, related[key])
+                    else:
+                        field.hydrate(obj, value)
                 except ValueError as e:
                     raise FieldValidationError(key, e.args[0])
 
         except FieldValidationError as e:
-            raise falcon.HTTPBadRequest('Validation error', str(e))
+            raise falcon.HTTPBadRequest(title='Validation error', description=str(e))
+
+    @timed('sql')
+    def resolve_related(self, items):
+        """
+        Fetch related objects of foreign key fields for many items at once
+        :param items: list of data dictionaries
+        :return: dictionary of related objects by primary key for every field
+        """
+        related = {}
+        for key, field in self.fields.items():
+            if field.readonly or not isinstance(field, ForeignKeyField):
+                continue
+
+            values = [item[key] for item in items if item.get(key) is not None]
+            if values:
+                related[key] = field.resolve(values)
+
+        return related
+
+    def _fields_from_request(self, req):
+        """
+        Names of fields requested with "fields" parameter
+        :return: set of names or None if all fields are requested
+        """
+        values = req.get_param_as_list('fields')
+        if values is None:
+            return None
+
+        # comma may be percent-encoded, so falcon keeps it in value
+        return frozenset(name for value in values for name in value.split(',') if name in self.fields)
+
+    def _sent_fields(self, sender, names=None):
+        return [field for key, field in self.fields.items()
+                if (sender is None or sender in field.show) and (names is None or key in names)]
 
     @classmethod
     def _filters_from_request(cls, req):
         filters = []
-        for key, v in req.params.items():
-            try:
-                field, op = key.rsplit('__', 1)
-            except ValueError:
-                field, op = key, 'exact'
+        for key, value in req.params.items():
+            entry = cls._filter_plan.get(key)
+            if entry is None:
+                continue
 
-            if field in cls._meta.filtering and op in cls._meta.filtering[field]:
-                filters.append((field, op, v))
+            name, filter_type, convert = entry
+            try:
+                filters.append((name, filter_type, convert(value)))
+            except (ValueError, TypeError) as e:
+                raise falcon.HTTPBadRequest(title='Invalid filter',
+                                            description='Invalid value of "{:s}" filter: {}'.format(key, e))
 
         return filters
 
@@ -205,29 +460,77 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
     db = None
 
     def get_list(self, req, **kwargs):
+        meta, objects = self.iter_list(req, **kwargs)
+
+        return {
+            'meta': meta,
+            'objects': list(objects)
+        }
+
+    def iter_list(self, req, **kwargs):
+        """
+        Get objects list as meta dictionary and iterator of dehydrated objects,
+        with stream option objects are fetched from database lazily
+        """
         try:
-            _ffr = self._filters_from_request(req)
-            _ffk = self._filters_from_kwargs(**kwargs)
-            filters = _ffr + _ffk
+            with stage('filters'):
+                _ffr = self._filters_from_request(req)
+                _ffk = self._filters_from_kwargs(**kwargs)
+                filters = _ffr + _ffk
         except DoesNotExist:
             raise falcon.HTTPNotFound()
 
-        offset = req.get_param_as_int('offset', min=0) or 0
-        limit = req.get_param_as_int('limit', min=1, max=self._meta.max_limit) or self._meta.limit
+        limit = get_param_as_int(req, 'limit', min_value=1, max_value=self._meta.max_limit) or self._meta.limit
+        names = self._fields_from_request(req)
+        attributes = self._projection('list', names)
+
+        if self._meta.pagination == 'cursor':
+            qs = self.db.select(filters, attributes=attributes)
+            meta, objects = self._paginate_cursor(self._join_related(qs, 'list', names), req.get_param('cursor'),
+                                                  limit)
+        else:
+            offset = get_param_as_int(req, 'offset', min_value=0) or 0
 
-        qs = self.db.select(filters)
-        meta, qs = self._paginate(qs, offset, limit)
+            qs = self.db.select(filters, self._meta.ordering, attributes)
+            joined_qs = self._join_related(qs, 'list', names)
 
-        return {
-            'meta': meta,
-            'objects': [self.dehydrate(obj, sender='list') for obj in qs]
-        }
+            if joined_qs is qs and self._meta.statement_cache:
+                meta, objects = self._paginate_statement(filters, attributes, offset, limit)
+            else:
+                meta, objects = self._paginate(joined_qs, offset, limit)
+
+        meta.update(self._count(req, qs))
+
+        if self._meta.stream and not isinstance(objects, list):
+            objects = self.db.iterate(objects)
+
+        return meta, self._dehydrate_objects(objects, 'list', names)
+
+    def export(self, req, **kwargs):
+        """
+        Get all objects selected by request filters as iterator of dehydrated objects, objects are fetched
+        from database lazily without pagination and count
+        """
+        try:
+            filters = self._filters_from_request(req) + self._filters_from_kwargs(**kwargs)
+        except DoesNotExist:
+            raise falcon.HTTPNotFound()
+
+        names = self._fields_from_request(req)
+        qs = self.db.select(filters, self._meta.ordering, self._projection('list', names))
+
+        return self._dehydrate_objects(self.db.iterate(self._join_related(qs, 'list', names)), 'list', names)
 
     def post_list(self, req, **kwargs):
-        if not isinstance(req.context['data'], dict):
-            raise falcon.HTTPBadRequest('Invalid content', 'Data should be an objects')
+        data = req.context['data']
 
-        data = copy(req.context['data'])
+        if isinstance(data, (list, Iterator)):
+            return self._post_objects(data, **kwargs)
+
+        if not isinstance(data, dict):
+            raise falcon.HTTPBadRequest(title='Invalid content', description='Data should be an objects')
+
+        data = copy(data)
         data.update(kwargs)
 
         with self.db.transaction():
@@ -236,7 +539,7 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
             try:
                 self.hydrate(obj, data)
             except FieldValidationError as e:
-                raise falcon.HTTPBadRequest('Bad request', str(e))
+                raise falcon.HTTPBadRequest(title='Bad request', description=str(e))
 
             self.save_obj(obj)
 
@@ -257,8 +560,8 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
     def put_list(self, req, **kwargs):
         data = req.context['data']
 
-        if not isinstance(data, list):
-            raise falcon.HTTPBadRequest('Invalid content', 'Data should be a list of objects')
+        if not isinstance(data, (list, Iterator)):
+            raise falcon.HTTPBadRequest(title='Invalid content', description='Data should be a list of objects')
 
         for k, v in kwargs.items():
             try:
@@ -269,47 +572,58 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
         # pk_field = self._meta.primary_key
         pk_field = self._meta.pk_
 
+        # items are hydrated and written by batches, so streamed data isn't kept in memory
         results = []
         with self.db.transaction():
-            for item in data:
-                if not isinstance(item, dict):
-                    raise falcon.HTTPBadRequest('Invalid content', 'Data should be a list of objects')
+            for batch in self._batches(data, **kwargs):
+                related = self.resolve_related(batch)
+                existing = self._find_objects(batch, **kwargs) if self._meta.bulk or self._meta.upsert else None
+                objects, created, updated = [], [], []
 
-                pk = item.get(pk_field)
-                item.update(kwargs)
+                for item in batch:
+                    pk = item.get(pk_field)
 
-                if not pk:
-                    obj = self.db.create_object()
-                else:
-                    params = copy(kwargs)
-                    params[pk_field] = pk
+                    if not pk:
+                        obj = self.db.create_object()
+                        created.append(obj)
+                    elif self._meta.upsert and self.fields[pk_field].convert(pk) not in existing:
+                        obj = self.db.create_object()
+                        created.append(obj)
+                    else:
+                        obj = self._get_existing_object(existing, pk, **kwargs)
+                        updated.append(obj)
 
-                    try:
-                        obj = self.find_object(**params)
-                    except DoesNotExist:
-                        raise falcon.HTTPBadRequest('Object not found', 'Object with primary key "%s" not found' % pk)
+                    self.hydrate(obj, item, related)
+                    objects.append(obj)
 
-                self.hydrate(obj, item)
+                    # without bulk options objects are saved one by one in order of data
+                    if not self._is_batch_write():
+                        self.save_obj(obj)
 
-                self.save_obj(obj)
+                if self._is_batch_write():
+                    self.save_objects(created, updated)
 
-                results.append(self.dehydrate(obj, sender='list'))
+                with stage('dehydrate'):
+                    results.extend(self.dehydrate(obj, sender='list') for obj in objects)
 
         return {
             'objects': results
         }
 
     def get_details(self, req, **kwargs):
+        names = self._fields_from_request(req)
+
         try:
-            obj = self.find_object(**kwargs)
+            obj = self.find_object(attributes=self._projection('details', names), **kwargs)
         except DoesNotExist:
             raise falcon.HTTPNotFound()
 
-        return self.dehydrate(obj, sender='details')
+        with stage('dehydrate'):
+            return self._dehydrate_shown(obj, 'details', names)
 
     def put_details(self, req, **kwargs):
         if not isinstance(req.context['data'], dict):
-            raise falcon.HTTPBadRequest('Invalid content', 'Data should be an objects')
+            raise falcon.HTTPBadRequest(title='Invalid content', description='Data should be an objects')
 
         try:
             obj = self.find_object(**kwargs)
@@ -329,10 +643,23 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
         if not affected_rows:
             raise falcon.HTTPNotFound()
 
-    def find_object(self, **kwargs):
+    def get_modification_stats(self, req, action, **kwargs):
+        """
+        Last modification date and count of objects selected by request, they are fetched with one
+        aggregate query and used as cheap validators of responses
+        :return: tuple of modification date and count
+        """
+        filters = self._filters_from_kwargs(**kwargs)
+        if action != 'details':
+            filters = self._filters_from_request(req) + filters
+
+        return self.db.get_modification_stats(self.db.select(filters), self._meta.modification_field)
+
+    @timed('sql')
+    def find_object(self, attributes=None, **kwargs):
         # TODO: alter
         _filters = self._filters_from_kwargs(**kwargs)
-        qs = self.db.select(_filters)[:1]
+        qs = list(self.db.apply_limit(self.db.select(_filters, attributes=attributes), 1))
 
         if len(qs) == 0:
             raise DoesNotExist()
@@ -343,13 +670,338 @@ class ModelResource(Resource, metaclass=ModelDeclarativeMetaclass):
         try:
             self.db.save_object(obj)
         except IntegrityError as e:
-            raise falcon.HTTPBadRequest('Integrity error', *e.args[0])
+            raise _integrity_error(e)
+
+    def save_objects(self, created, updated=()):
+        """
+        Save many objects, with bulk option new objects are inserted with multi-row INSERT statements
+        and changed objects are updated by chunks, with upsert option objects with primary keys are written
+        by INSERT ... ON CONFLICT DO UPDATE statements. Custom save methods of models are not called then.
+        :param created: new objects
+        :param updated: existing objects
+        """
+        if not self._meta.bulk and not self._meta.upsert:
+            for obj in chain(created, updated):
+                self.save_obj(obj)
+            return
+
+        chunk_size = self._meta.bulk_chunk_size
+
+        try:
+            if self._meta.upsert and self.db.supports_upsert():
+                # objects with primary keys are written together, rows created concurrently are updated
+                pk_field = self._meta.pk_
+                new = [obj for obj in created if getattr(obj, pk_field) is None]
+                upserted = [obj for obj in created if getattr(obj, pk_field) is not None] + list(updated)
+
+                self.db.bulk_create(new, chunk_size)
+                self.db.upsert(upserted, chunk_size)
+            else:
+                self.db.bulk_create(created, chunk_size)
+                self.db.bulk_update(updated, chunk_size)
+        except IntegrityError as e:
+            raise _integrity_error(e)
+
+    def _is_batch_write(self):
+        return self._meta.bulk or self._meta.upsert
+
+    def _post_objects(self, data, **kwargs):
+        """
+        Create objects from list or iterator of data dictionaries
+        """
+        results = []
+
+        with self.db.transaction():
+            for batch in self._batches(data, **kwargs):
+                related = self.resolve_related(batch)
+                objects = []
+
+                for item in batch:
+                    obj = self.db.create_object()
+                    self.hydrate(obj, item, related)
+                    objects.append(obj)
+
+                    if not self._is_batch_write():
+                        self.save_obj(obj)
+
+                if self._is_batch_write():
+                    self.save_objects(objects)
+
+                results.extend({self._meta.primary_key: getattr(obj, self._meta.pk_)} for obj in objects)
+
+        return {
+            'objects': results
+        }
+
+    def _batches(self, items, **kwargs):
+        """
+        Split items to batches of bulk_chunk_size, kwargs are added to every item
+        :return: iterator of lists of items
+        """
+        items = iter(items)
+
+        while True:
+            batch = list(islice(items, self._meta.bulk_chunk_size))
+            if not batch:
+                return
+
+            for item in batch:
+                if not isinstance(item, dict):
+                    raise falcon.HTTPBadRequest(title='Invalid content', description='Data should be a list of objects')
+
+                item.update(kwargs)
+
+            yield batch
+
+    @timed('sql')
+    def _find_objects(self, items, **kwargs):
+        """
+        Fetch existing objects referenced by items with IN queries
+        :return: dictionary of objects by primary key
+        """
+        pk_field = self._meta.pk_
+        pks = [self.fields[pk_field].convert(item[pk_field]) for item in items if item.get(pk_field)]
+        filters = self._filters_from_kwargs(**kwargs)
+
+        objects = {}
+        for start in range(0, len(pks), MAX_IN_VALUES):
+            query = self.db.select(filters + [(pk_field, 'in', pks[start:start + MAX_IN_VALUES])])
+            objects.update((getattr(obj, pk_field), obj) for obj in query)
+
+        missing = [pk for pk in pks if pk not in objects]
+        if self._meta.upsert and filters and missing:
+            # upsert must not overwrite objects out of the filtered scope
+            for start in range(0, len(missing), MAX_IN_VALUES):
+                for obj in self.db.select([(pk_field, 'in', missing[start:start + MAX_IN_VALUES])]):
+                    raise falcon.HTTPBadRequest(
+                        title='Object not found',
+                        description='Object with primary key "%s" not found' % getattr(obj, pk_field))
+
+        return objects
+
+    def _get_existing_object(self, existing, pk, **kwargs):
+        try:
+            if existing is None:
+                params = copy(kwargs)
+                params[self._meta.pk_] = pk
+
+                return self.find_object(**params)
+
+            try:
+                return existing[self.fields[self._meta.pk_].convert(pk)]
+            except KeyError:
+                raise DoesNotExist()
+        except DoesNotExist:
+            raise falcon.HTTPBadRequest(title='Object not found',
+                                        description='Object with primary key "%s" not found' % pk)
+
+    def _projection(self, sender, names=None):
+        """
+        Attributes needed to dehydrate fields shown for sender
+        :return: set of attribute names or None if some field may need any attribute
+        """
+        if type(self).dehydrate is not Resource.dehydrate:
+            # overridden dehydrate may read any attribute
+            return None
+
+        attributes = {self._meta.pk_}
+
+        for field in self._sent_fields(sender, names):
+            if isinstance(field, ToManyField):
+                continue
+
+            if not isinstance(field, ForeignKeyField) and field.direct_attribute is None:
+                return None
+
+            attributes.add(field.attribute)
+
+        return attributes
+
+    def _dehydrate_shown(self, obj, sender, names=None):
+        """
+        Dehydrate object, names are passed only if requested, so dehydrate overridden without fields works
+        """
+        if names is None:
+            return self.dehydrate(obj, sender=sender)
+
+        return self.dehydrate(obj, sender=sender, fields=names)
+
+    def _join_related(self, qs, sender, names=None):
+        """
+        Join objects of foreign keys which need more than raw key value
+        """
+        attributes = [field.attribute for field in self._sent_fields(sender, names)
+                      if isinstance(field, ForeignKeyField) and (field.full or not field.id_attribute)]
+
+        return self.db.join_related(qs, attributes) if attributes else qs
+
+    def _prefetch_related(self, objects, sender, names=None):
+        """
+        Fetch objects of to-many relations for the whole page at once
+        """
+        attributes = [field.attribute for field in self._sent_fields(sender, names) if isinstance(field, ToManyField)]
+
+        return self.db.prefetch_related(objects, attributes) if attributes and objects else objects
+
+    def _dehydrate_objects(self, objects, sender, names=None):
+        """
+        Dehydrate objects by batches, so relations are prefetched once per batch
+        """
+        objects = iter(objects)
+
+        while True:
+            with stage('sql'):
+                batch = list(islice(objects, MAX_IN_VALUES))
+                if batch:
+                    batch = self._prefetch_related(batch, sender, names)
+
+            if not batch:
+                break
+
+            with stage('dehydrate'):
+                dehydrated = [self._dehydrate_shown(obj, sender, names) for obj in batch]
+
+            yield from dehydrated
 
     def _paginate(self, qs, offset, limit):
         meta = {
             'limit': limit,
             'offset': offset,
-            'total_count': qs.count(),  # todo: make it using db adapter
         }
 
-        return meta, qs[offset:offset + limit]
+        return meta, self.db.apply_limit(qs, limit, offset)
+
+    def _paginate_statement(self, filters, attributes, offset, limit):
+        """
+        Offset pagination of query without joins, SQL of page query is cached by its shape
+        """
+        meta = {
+            'limit': limit,
+            'offset': offset,
+        }
+
+        return meta, self.db.select_page(filters, self._meta.ordering, attributes, limit, offset)
+
+    def _paginate_cursor(self, qs, cursor, limit):
+        """
+        Keyset pagination: page is selected by primary key of the last seen object
+        instead of offset, so every page costs the same as the first one.
+        Objects are ordered by primary key, descending if "-<pk>" is in ordering option.
+        """
+        pk = self._meta.pk_
+        descending = '-' + pk in self._meta.ordering
+
+        meta = {
+            'limit': limit,
+        }
+
+        backwards = False
+        if cursor:
+            try:
+                value, backwards = _decode_cursor(cursor)
+                value = self.fields[pk].convert(value)
+            except (ValueError, TypeError):
+                raise falcon.HTTPBadRequest(title='Invalid cursor', description='Cursor value cannot be parsed')
+
+            qs = self.db.apply_filters(qs, [(pk, 'lt' if descending != backwards else 'gt', value)])
+
+        qs = self.db.apply_ordering(qs, ['-' + pk if descending != backwards else pk])
+        objects = list(self.db.apply_limit(qs, limit + 1))
+
+        has_more = len(objects) > limit
+        objects = objects[:limit]
+        if backwards:
+            objects.reverse()
+
+        has_next = has_more if not backwards else True
+        has_previous = has_more if backwards else bool(cursor)
+
+        meta['next'] = _encode_cursor(getattr(objects[-1], pk), False) if objects and has_next else None
+        meta['previous'] = _encode_cursor(getattr(objects[0], pk), True) if objects and has_previous else None
+
+        return meta, objects
+
+    def _count(self, req, qs):
+        """
+        Count objects using strategy from count option:
+        "exact" runs COUNT query, "estimated" asks database planner statistics,
+        "cached" keeps exact count in cache for count_cache_ttl seconds and "off" skips counting.
+        Client can skip counting with "count=false" parameter.
+        :return: meta dictionary with total count and used strategy
+        """
+        strategy = self._meta.count
+        if req.get_param_as_bool('count') is False:
+            strategy = 'off'
+
+        if strategy == 'off':
+            return {'count_strategy': strategy}
+
+        total_count = None
+        if strategy == 'estimated':
+            total_count = self.db.estimate_count(qs)
+        elif strategy == 'cached' and self._meta.cache:
+            key = '{:s}:count:{:s}'.format(self._meta.resource_name, self.db.query_key(qs))
+            total_count = self._meta.cache.get(key)
+
+            if total_count is None:
+                total_count = self.db.count(qs)
+                self._meta.cache.set(key, total_count, self._meta.count_cache_ttl)
+
+        if total_count is None:
+            strategy = 'exact'
+            total_count = self.db.count(qs)
+
+        return {
+            'total_count': total_count,
+            'count_strategy': strategy,
+        }
+
+
+def _create_filter_converter(field, filter_type):
+    """
+    Converter of filter parameter value, values are converted by resource field
+    so they are compared with columns of the same type
+    """
+    if filter_type in ('contains', 'startswith', 'endswith'):
+        convert = _identity
+    elif filter_type == 'is_null':
+        convert = parse_bool
+    elif field is not None:
+        convert = field.convert_filter
+    else:
+        convert = _identity
+
+    if filter_type == 'in':
+        def convert_list(value):
+            values = value if isinstance(value, list) else [value]
+            return [convert(item) for v in values for item in v.split(',')]
+
+        return convert_list
+
+    def convert_single(value):
+        if isinstance(value, list):
+            raise InvalidValue('Only one value is allowed')
+
+        return convert(value)
+
+    return convert_single
+
+
+def _identity(value):
+    return value
+
+
+def _integrity_error(e):
+    return falcon.HTTPBadRequest(title='Integrity error', description=' '.join(str(arg) for arg in e.args[0]))
+
+
+def _encode_cursor(value, backwards):
+    data = json.dumps([value, backwards]).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor):
+    data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    value, backwards = json.loads(data.decode('utf-8'))
+
+    return value, bool(backwards)
@@ -1,23 +1,103 @@
+import importlib
+
+import falcon
+
 from .. import settings
 
+# content types of serialization formats, the first one is used for responses
+CONTENT_TYPES = {
+    'json': ('application/json',),
+    'msgpack': ('application/msgpack', 'application/x-msgpack'),
+    'ndjson': ('application/x-ndjson',),
+    'csv': ('text/csv',),
+}
+
+FORMATS = ('json', 'yaml', 'msgpack', 'ndjson', 'csv')
+
+_available_media_types = None
+
 
 def get_serializer(req):
-    type = settings.SERIALIZER_DEFAULT
+    """
+    Serializer of response, it's selected by request parameter, then by Accept header
+    """
+    type = None
 
     if settings.SERIALIZER_REQUEST_PARAM:
-        type = req.get_param(settings.SERIALIZER_REQUEST_PARAM) or type
+        type = req.get_param(settings.SERIALIZER_REQUEST_PARAM)
 
-    return _get_serializer_by_type(type)
+    if type is None and req.accept != '*/*':
+        media_type = req.client_prefers(_get_available_media_types())
+        type = _get_type_by_media_type(media_type)
 
+    type = type or settings.SERIALIZER_DEFAULT
 
-def _get_serializer_by_type(type):
-    if type == 'json':
-        from . import json
+    try:
+        return _get_serializer_by_type(type)
+    except (NotImplementedError, ImportError):
+        raise falcon.HTTPNotAcceptable(description='Format "{:s}" is not supported'.format(type))
+
+
+def depends_on_accept(req):
+    """
+    Check serializer of response may be selected by Accept header, so response varies by it
+    """
+    return not settings.SERIALIZER_REQUEST_PARAM or req.get_param(settings.SERIALIZER_REQUEST_PARAM) is None
+
+
+def get_deserializer(req):
+    """
+    Serializer of request body, it's selected by request parameter, then by Content-Type header
+    """
+    type = None
+
+    if settings.SERIALIZER_REQUEST_PARAM:
+        type = req.get_param(settings.SERIALIZER_REQUEST_PARAM)
+
+    if type is None and req.content_type:
+        type = _get_type_by_media_type(req.content_type.split(';', 1)[0].strip().lower())
 
-        return json
-    elif type == 'yaml':
-        from . import yaml
+    type = type or settings.SERIALIZER_DEFAULT
 
-        return yaml
+    try:
+        return _get_serializer_by_type(type)
+    except (NotImplementedError, ImportError):
+        raise falcon.HTTPBadRequest(title='Invalid format', description='Format "{:s}" is not supported'.format(type))
+
+
+def _get_type_by_media_type(media_type):
+    for type, content_types in CONTENT_TYPES.items():
+        if media_type in content_types:
+            return type
+
+    return None
+
+
+def _get_available_media_types():
+    """
+    Media types of formats which dependencies are installed, default format goes first
+    """
+    global _available_media_types
+
+    if _available_media_types is None:
+        types = sorted(CONTENT_TYPES, key=lambda type: type != settings.SERIALIZER_DEFAULT)
+        media_types = []
+
+        for type in types:
+            try:
+                _get_serializer_by_type(type)
+            except ImportError:
+                continue
+
+            media_types.extend(CONTENT_TYPES[type])
+
+        _available_media_types = media_types
+
+    return _available_media_types
+
+
+def _get_serializer_by_type(type):
+    if type in FORMATS:
+        return importlib.import_module('.' + type, __name__)
 
-    raise NotImplemented
\ No newline at end of file
+    raise NotImplementedError('Unknown serialization format "{:s}"'.format(type))
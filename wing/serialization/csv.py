@@ -0,0 +1,71 @@
+import csv
+import io
+from datetime import datetime
+from itertools import islice
+
+from . import json
+
+content_type = 'text/csv'
+
+
+def _value(value):
+    if isinstance(value, datetime):
+        return value.strftime(json.DATETIME_FORMAT)
+
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+
+    return value
+
+
+def _write_rows(header, objects, write_header=False):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    if write_header:
+        writer.writerow(header)
+
+    for obj in objects:
+        writer.writerow([_value(obj.get(name)) for name in header])
+
+    return buffer.getvalue().encode('utf-8')
+
+
+def dumpb(obj):
+    """
+    Serialize objects of list response as rows, header row contains keys of the first object
+    """
+    objects = obj['objects'] if isinstance(obj, dict) and isinstance(obj.get('objects'), list) else [obj]
+
+    return b''.join(iter_dumps(None, objects))
+
+
+def dumps(obj):
+    return dumpb(obj).decode('utf-8')
+
+
+def iter_dumps(meta, objects, chunk_size=100):
+    """
+    Serialize objects by parts, meta isn't written
+    :param meta: meta dictionary
+    :param objects: iterable of objects with the same keys
+    :param chunk_size: count of objects serialized to one part
+    :return: iterator of bytes
+    """
+    objects = iter(objects)
+    header = None
+
+    while True:
+        chunk = list(islice(objects, chunk_size))
+        if not chunk:
+            break
+
+        if header is None:
+            header = list(chunk[0])
+            yield _write_rows(header, chunk, write_header=True)
+        else:
+            yield _write_rows(header, chunk)
+
+
+def loads(content):
+    raise ValueError('CSV format can be used only for responses')
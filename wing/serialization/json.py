@@ -1,20 +1,148 @@
+import importlib
 import json
 from datetime import datetime
+from itertools import islice
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
 
 content_type = 'application/json'
 
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# fast backends in order of preference, stdlib json is used if none is installed
+BACKENDS = ('orjson', 'ujson', 'rapidjson')
+
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
-            return obj.strftime('%Y-%m-%d %H:%M:%S')
+            return obj.strftime(DATETIME_FORMAT)
         else:
             return json.JSONEncoder.default(self, obj)
 
 
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime(DATETIME_FORMAT)
+
+    raise TypeError('Object of type {:s} is not JSON serializable'.format(type(obj).__name__))
+
+
+def _create_dumpb(name, module):
+    if name == 'orjson':
+        option = module.OPT_PASSTHROUGH_DATETIME | module.OPT_NON_STR_KEYS
+
+        return lambda obj: module.dumps(obj, default=_default, option=option)
+
+    return lambda obj: module.dumps(obj, default=_default).encode('utf-8')
+
+
+def _detect_backend():
+    """
+    Find installed backend which serializes datetime the same way as JSONEncoder
+    :return: backend name, dumpb and loads functions
+    """
+    probe = {'date': datetime(2000, 1, 2, 3, 4, 5)}
+
+    for name in BACKENDS:
+        try:
+            module = importlib.import_module(name)
+            dumpb = _create_dumpb(name, module)
+
+            if module.loads(dumpb(probe)) == {'date': '2000-01-02 03:04:05'}:
+                return name, dumpb, module.loads
+        except Exception:
+            continue
+
+    return 'json', lambda obj: json.dumps(obj, cls=JSONEncoder).encode('utf-8'), json.loads
+
+
+backend, dumpb, _loads = _detect_backend()
+
+
 def dumps(obj):
-    return json.dumps(obj, cls=JSONEncoder)
+    return dumpb(obj).decode('utf-8')
+
+
+def iter_dumps(meta, objects, chunk_size=100):
+    """
+    Serialize list response by parts
+    :param meta: meta dictionary
+    :param objects: iterable of objects
+    :param chunk_size: count of objects serialized to one part
+    :return: iterator of bytes
+    """
+    yield b'{"meta": ' + dumpb(meta) + b', "objects": ['
+
+    objects = iter(objects)
+    separator = b''
+    while True:
+        chunk = b', '.join(dumpb(obj) for obj in islice(objects, chunk_size))
+        if not chunk:
+            break
+
+        yield separator + chunk
+        separator = b', '
+
+    yield b']}'
 
 
 def loads(content):
-    return json.loads(content)
+    return _loads(content)
+
+
+if ijson is not None:
+    def iter_loads(stream):
+        """
+        Parse stream lazily, items of top-level array are parsed one by one, other values are parsed at once
+        :param stream: file-like object of bytes
+        :return: iterator of items or parsed value
+        """
+        stream = _PrefixedStream(stream)
+
+        if stream.peek() != b'[':
+            return loads(stream.read())
+
+        return _iter_items(stream)
+
+    def _iter_items(stream):
+        # errors of incomplete or malformed JSON are not ValueError in ijson
+        try:
+            yield from ijson.items(stream, 'item', use_float=True)
+        except ijson.JSONError as e:
+            raise ValueError(*e.args)
+
+
+class _PrefixedStream:
+    """
+    Stream which allows to look at the first not whitespace byte
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.prefix = b''
+
+    def peek(self):
+        while not self.prefix:
+            byte = self.stream.read(1)
+            if not byte:
+                break
+
+            if not byte.isspace():
+                self.prefix = byte
+
+        return self.prefix
+
+    def read(self, size=-1):
+        if size == 0:
+            return b''
+
+        prefix, self.prefix = self.prefix, b''
+
+        if size is None or size < 0:
+            return prefix + self.stream.read()
+
+        return prefix + self.stream.read(size - len(prefix)) if size > len(prefix) else prefix
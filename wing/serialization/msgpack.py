@@ -0,0 +1,32 @@
+from datetime import datetime
+
+import msgpack
+
+from .json import DATETIME_FORMAT
+
+content_type = 'application/msgpack'
+
+binary = True
+
+
+def _default(obj):
+    if isinstance(obj, datetime):
+        return obj.strftime(DATETIME_FORMAT)
+
+    raise TypeError('Object of type {:s} is not MessagePack serializable'.format(type(obj).__name__))
+
+
+def dumps(obj):
+    return msgpack.packb(obj, default=_default, use_bin_type=True)
+
+
+dumpb = dumps
+
+
+def loads(content):
+    try:
+        return msgpack.unpackb(content, raw=False)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(*e.args)
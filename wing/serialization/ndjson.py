@@ -0,0 +1,67 @@
+from itertools import islice
+
+from . import json
+
+content_type = 'application/x-ndjson'
+
+READ_CHUNK_SIZE = 65536
+
+
+def dumpb(obj):
+    """
+    Serialize objects of list response one per line, other responses are serialized to one line
+    """
+    if isinstance(obj, dict) and isinstance(obj.get('objects'), list):
+        return b''.join(json.dumpb(item) + b'\n' for item in obj['objects'])
+
+    return json.dumpb(obj) + b'\n'
+
+
+def dumps(obj):
+    return dumpb(obj).decode('utf-8')
+
+
+def iter_dumps(meta, objects, chunk_size=100):
+    """
+    Serialize objects by parts, meta isn't written
+    :param meta: meta dictionary
+    :param objects: iterable of objects
+    :param chunk_size: count of objects serialized to one part
+    :return: iterator of bytes
+    """
+    objects = iter(objects)
+
+    while True:
+        chunk = b''.join(json.dumpb(obj) + b'\n' for obj in islice(objects, chunk_size))
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def loads(content):
+    return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+def iter_loads(stream):
+    """
+    Parse items of stream lazily line by line
+    :param stream: file-like object of bytes
+    :return: iterator of items
+    """
+    buffer = b''
+
+    while True:
+        chunk = stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        lines = (buffer + chunk).split(b'\n')
+        buffer = lines.pop()
+
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+
+    if buffer.strip():
+        yield json.loads(buffer)
@@ -2,6 +2,32 @@ DEFAULT_MAX_LIMIT = 1000
 
 DEFAULT_LIMIT = 20
 
+DEFAULT_COUNT_CACHE_TTL = 60
+
 SERIALIZER_REQUEST_PARAM = 'format'
 
 SERIALIZER_DEFAULT = 'json'
+
+MAX_IN_VALUES = 500
+
+BULK_CHUNK_SIZE = 500
+
+MAX_COMPILED_DEHYDRATORS = 64
+
+STATEMENT_CACHE_SIZE = 256
+
+MAX_REPEATED_QUERIES = 10
+
+DEFAULT_CACHE_MAX_SIZE = 1024
+
+DEFAULT_CACHE_SWEEP_INTERVAL = 60
+
+DEFAULT_L1_CACHE_TTL = 1
+
+DEFAULT_RESPONSE_CACHE_TTL = 300
+
+OBJECT_VERSION_TTL = 86400
+
+ASGI_MAX_WORKERS = 32
+
+ASGI_STREAM_QUEUE_SIZE = 16